@@ -8,7 +8,7 @@ import { Button } from "@/components/ui/button"
 import { Label } from "@/components/ui/label"
 import { SearchHistory, SearchQuery, SingleSearchQuery } from "@/types"
 import { objToUrl, urlToObj } from "@/utils"
-import { search } from "@/utils/api"
+import { recordFeedback, search } from "@/utils/api"
 import { addCookies, setSingleCookie } from "@/utils/cookie"
 import Link from "next/link"
 import { useSearchParams } from "next/navigation"
@@ -65,25 +65,32 @@ const SearchResultPage: React.FC<{}> = () => {
             }
 
             setHistory(history)
-            addCookies(history).then(v => setIndex(v))
+            addCookies(history).then(v => {
+                setIndex(v)
+                recordFeedback(history, v)
+            })
         })
     }, [])
 
     useEffect(() => {
         if (data === undefined || index < 0 || history === undefined) return
-        const id = setTimeout(() => setSingleCookie({
-            ...history,
-            webpages: data.filter(
-                d => d.detail.likeState === 'liked' || d.detail.clicked || d.detail.likeState === 'disliked'
-            ).map(d => ({
-                ...d.detail,
-                setClicked: undefined,
-                setLikeState: undefined,
-                getSimilarPage: undefined,
-                relevance: d.detail.likeState === 'disliked' ? -1 : 1,
-                similarPageLink: undefined,
-            }))
-        }, index), 500)
+        const id = setTimeout(() => {
+            const h: SearchHistory = {
+                ...history,
+                webpages: data.filter(
+                    d => d.detail.likeState === 'liked' || d.detail.clicked || d.detail.likeState === 'disliked'
+                ).map(d => ({
+                    ...d.detail,
+                    setClicked: undefined,
+                    setLikeState: undefined,
+                    getSimilarPage: undefined,
+                    relevance: d.detail.likeState === 'disliked' ? -1 : 1,
+                    similarPageLink: undefined,
+                }))
+            }
+            setSingleCookie(h, index)
+            recordFeedback(h, index)
+        }, 500)
         return () => clearTimeout(id)
     }, [data])
 
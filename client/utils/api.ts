@@ -1,12 +1,38 @@
 'use server'
 
-import { QuerySuggestion, SearchQuery, SearchResult } from "@/types"
-import { getCookies } from "./cookie"
+import { QuerySuggestion, SearchHistory, SearchQuery, SearchResult } from "@/types"
+import { getCookies, getSessionId } from "./cookie"
 
 const api_url = 'http://127.0.0.1:8000'
 
+const getSession = async (): Promise<string> => {
+    const [sessionId, isNew] = await getSessionId()
+    // histories saved before the session existed are sent once
+    if (isNew) await recordFeedback(await getCookies(), 0, sessionId)
+    return sessionId
+}
+
+export const recordFeedback = async (history: SearchHistory | SearchHistory[], index: number, sessionId?: string) => {
+    const h = Array.isArray(history) ? history : [history]
+    if (h.length === 0) return
+    if (sessionId === undefined) sessionId = await getSession()
+
+    try {
+        await fetch(`${api_url}/feedback`, {
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            method: 'POST',
+            body: JSON.stringify({
+                session_id: sessionId,
+                histories: Object.fromEntries(h.map((a, i) => [index + i, a]))
+            })
+        })
+    } catch (e) {}
+}
+
 export const search = async (query: SearchQuery): Promise<SearchResult> => {
-    const cookie = await getCookies()
+    const sessionId = await getSession()
     let url = ''
     let body = {}
 
@@ -14,13 +40,13 @@ export const search = async (query: SearchQuery): Promise<SearchResult> => {
         url = `${api_url}/search`
         body = {
             query: { ...query },
-            cookies: cookie
+            session_id: sessionId
         }
     } else {
         url = `${api_url}/joined_search`
         body = {
             queries: { ...query },
-            cookies: cookie
+            session_id: sessionId
         }
     }
 
@@ -53,7 +79,7 @@ export const suggestQuery = async (query: string): Promise<QuerySuggestion> => {
         return {}
     }
 
-    const cookie = await getCookies()
+    const sessionId = await getSession()
 
     try {
         const response = await fetch(`${api_url}/suggest_query`, {
@@ -63,7 +89,7 @@ export const suggestQuery = async (query: string): Promise<QuerySuggestion> => {
             method: 'POST',
             body: JSON.stringify({
                 query: query,
-                cookies: cookie
+                session_id: sessionId
             })
         })
     
@@ -50,4 +50,15 @@ export const setSingleCookie = async (history: SearchHistory, index: number) =>
     let h = await getCookies()
     h[index] = history
     await setCookies(h)
+}
+
+export const getSessionId = async (): Promise<[string, boolean]> => {
+    // relevance feedback is kept by the server under this id, true if it is newly created
+    const cookieStore = await cookies()
+    const id = cookieStore.get('session_id')
+    if (id !== undefined) return [id.value, false]
+
+    const sessionId = crypto.randomUUID()
+    cookieStore.set('session_id', sessionId, {secure: true, httpOnly: true, path: '/'})
+    return [sessionId, true]
 }
\ No newline at end of file
@@ -0,0 +1,76 @@
+from bisect import bisect_left, bisect_right
+import heapq
+from search import get_keywords_with_freq
+from db.database import *
+from cache import on_index_change
+from utils import clean_text, stemmer
+import threading
+
+class AutocompleteIndex:
+    def __init__(self):
+        # keywords sorted alphabetically so that all completions of a prefix are a contiguous range
+        self.words: list[str] = list()
+        self.word_ids: list[int] = list()
+        self.frequencies: list[int] = list()
+        # short prefixes match long ranges, their top completions are kept
+        self.top: dict[str, list[int]] = dict()
+
+    def load(self, db = Session()):
+        keywords = sorted(get_keywords_with_freq(db=db).items())
+        self.words = [i[0] for i in keywords]
+        self.word_ids = [i[1][0] for i in keywords]
+        self.frequencies = [i[1][1] for i in keywords]
+
+        prefixes = {w[:n] for w in self.words for n in range(1, autocomplete_cached_prefix_length + 1)}
+        for prefix in prefixes:
+            self.top[prefix] = self.rank(*self.range(prefix), max_autocomplete_words)
+        return self
+
+    def range(self, prefix: str) -> tuple[int, int]:
+        return bisect_left(self.words, prefix), bisect_right(self.words, prefix + chr(0x10ffff))
+
+    def rank(self, lo: int, hi: int, k: int) -> list[int]:
+        # most frequent first, alphabetically for ties
+        return heapq.nlargest(k, range(lo, hi), key=lambda i: self.frequencies[i])
+
+    def complete(self, prefix: str, k: int = max_autocomplete_words) -> list[tuple[str, int, int]]:
+        # word, word_id, frequency
+        if len(prefix) <= 0 or k <= 0: return list()
+        if len(prefix) <= autocomplete_cached_prefix_length and k <= max_autocomplete_words:
+            indexes = self.top.get(prefix, list())[:k]
+        else:
+            indexes = self.rank(*self.range(prefix), k)
+        return [(self.words[i], self.word_ids[i], self.frequencies[i]) for i in indexes]
+
+    def autocomplete(self, query: str, k: int = max_autocomplete_words) -> list[tuple[str, int, int]]:
+        # complete the last typed word, which is matched both as typed and stemmed
+        words = clean_text(query).split(' ')
+        prefix = words[-1]
+        if len(prefix) <= 0: return list()
+
+        result = {i[0]: i for i in self.complete(prefix, k)}
+        stemmed = stemmer.stem(prefix)
+        if stemmed != prefix:
+            result.update({i[0]: i for i in self.complete(stemmed, k)})
+        return sorted(result.values(), key=lambda i: (-i[2], i[0]))[:k]
+
+autocomplete_index: AutocompleteIndex | None = None
+autocomplete_lock = threading.Lock()
+
+@on_index_change
+def reset_autocomplete_index():
+    global autocomplete_index
+    autocomplete_index = None
+
+def get_autocomplete_index() -> AutocompleteIndex:
+    global autocomplete_index
+    if autocomplete_index is None:
+        with autocomplete_lock:
+            if autocomplete_index is None: load_autocomplete_index()
+    return autocomplete_index
+
+def load_autocomplete_index() -> AutocompleteIndex:
+    global autocomplete_index
+    with Session() as db:
+        autocomplete_index = AutocompleteIndex().load(db=db)
+    return autocomplete_index
@@ -0,0 +1,215 @@
+from bs4 import BeautifulSoup as bs
+from collections import deque
+from frontier import Frontier
+from hashlib import sha1
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from page_parser import parse_html
+from utils import extract_keywords, extract_positions, analyze_query, index_text, clean_text, is_plain_query, get_stopwords, stem, tokenize_word
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# python benchmark.py query [n]
+# python benchmark.py index [n]
+# python benchmark.py parse [n]
+# python benchmark.py frontier [n]
+# python benchmark.py serve [n] [port] [changed]
+words = '''
+    computer science university hong kong engineering student research movie film review news
+    dog cat animal bank finance market stock economy music sport game player team season
+    running runs ran cannot gonna data database search engine index query page link web
+    international business policy government health medical school 2024 covid19 iphone
+'''.split()
+
+def make_queries(n: int, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+    vocabulary = words + sorted(get_stopwords())[:50]
+    queries = []
+    for _ in range(n):
+        query = [rng.choice(vocabulary) for _ in range(rng.randint(1, 6))]
+        if rng.random() < 0.3: query[0] = query[0].capitalize()
+        if rng.random() < 0.2: query.append(rng.choice(['!', ',', '?', "'s", '-']))
+        if rng.random() < 0.3 and len(query) > 1:
+            i = rng.randrange(len(query) - 1)
+            j = rng.randint(i + 1, len(query))
+            query[i] = '"' + query[i]
+            query[j - 1] = query[j - 1] + '"'
+        queries.append(' '.join(query))
+    return queries
+
+# words of other languages and punctuation left by clean_text
+symbols = ['café', 'naïve', 'über', '—', '…', '“quoted”', 'don’t', '«mot»', '½', 'straße', '東京', 'x²']
+
+def make_pages(n: int, seed: int = 0) -> list[str]:
+    # fixed html corpus
+    rng = random.Random(seed)
+    vocabulary = words + sorted(get_stopwords())[:100]
+    def sentence(length: int) -> str:
+        s = [rng.choice(vocabulary) if rng.random() < 0.97 else rng.choice(symbols) for _ in range(length)]
+        s[0] = s[0].capitalize()
+        return ' '.join(s) + rng.choice(['.', '.', '!', '?', ';'])
+    pages = []
+    for i in range(n):
+        paragraphs = ''.join(
+            f'<p>{" ".join(sentence(rng.randint(4, 20)) for _ in range(rng.randint(1, 6)))}</p>\n'
+            for _ in range(rng.randint(3, 30))
+        )
+        # every page is reachable from page0
+        links = ''.join(f'<li><a href="page{j}.htm">{sentence(3)}</a></li>' for j in [(i + 1) % n] + [rng.randrange(n) for _ in range(rng.randint(0, 10))])
+        pages.append(f'<html><head><title>{sentence(rng.randint(1, 8))}</title></head><body>{paragraphs}<ul>{links}</ul></body></html>')
+    return pages
+
+def time_per_call(func, inputs: list, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for i in inputs: func(i)
+    return (time.perf_counter() - start) / (repeat * len(inputs))
+
+def benchmark_query(n: int = 1000, repeat: int = 5):
+    queries = make_queries(n)
+    mismatched = [q for q in queries if extract_keywords(q, is_query=True) != analyze_query(q)]
+    fallback = sum(1 for q in queries if not is_plain_query(clean_text(q)))
+    print(f'{len(queries)} queries, {fallback} left to extract_keywords, {len(mismatched)} mismatched')
+    for q in mismatched[:10]: print(f'  {q!r}: {extract_keywords(q, is_query=True)} != {analyze_query(q)}')
+
+    stem.cache_clear()
+    old = time_per_call(lambda q: extract_keywords(q, is_query=True), queries, repeat)
+    new = time_per_call(analyze_query, queries, repeat)
+    print(f'extract_keywords: {old * 1e6:.1f}us per query')
+    print(f'analyze_query:    {new * 1e6:.1f}us per query ({old / new:.1f}x), {stem.cache_info()}')
+
+def benchmark_index(n: int = 200, repeat: int = 3):
+    texts = []
+    for page in make_pages(n):
+        soup = bs(page, 'html.parser')
+        texts += [soup.title.string, soup.get_text()]
+    print(f'{n} pages, {sum(len(t) for t in texts) / 1e6:.1f}MB of text')
+
+    def old_pipeline(text: str): return extract_keywords(text, is_query=False)[0], extract_positions(text)
+    mismatched = [t for t in texts if old_pipeline(t) != index_text(t)]
+    print(f'{len(mismatched)} mismatched')
+
+    stem.cache_clear()
+    tokenize_word.cache_clear()
+    old = time_per_call(old_pipeline, texts, repeat)
+    new = time_per_call(index_text, texts, repeat)
+    print(f'extract_keywords + extract_positions: {old * 1e3:.2f}ms per text')
+    print(f'index_text: {new * 1e3:.2f}ms per text ({old / new:.1f}x), {stem.cache_info()}')
+
+def benchmark_parse(n: int = 300, repeat: int = 3):
+    pages = make_pages(n)
+    def soup_parse(page: str):
+        soup = bs(page, 'html.parser')
+        return soup.title.string if soup.title else None, [a['href'] for a in soup.find_all('a', href=True)], soup.get_text()
+    def is_mismatched(page: str, backend: str) -> bool:
+        # text compared as indexed, the optional backends differ in whitespace
+        (title, links, text), (new_title, new_links, new_text) = soup_parse(page), parse_html(page, backend)
+        return (title, links, clean_text(text)) != (new_title, new_links, clean_text(new_text))
+
+    old = time_per_call(soup_parse, pages, repeat)
+    print(f'BeautifulSoup: {old * 1e3:.3f}ms per page')
+    for backend in ('html.parser', 'lxml', 'selectolax'):
+        try: mismatched = [p for p in pages if is_mismatched(p, backend)]
+        except ImportError as e:
+            print(f'{backend}: not installed ({e})')
+            continue
+        new = time_per_call(lambda p: parse_html(p, backend), pages, repeat)
+        print(f'{backend}: {new * 1e3:.3f}ms per page ({old / new:.1f}x), {len(mismatched)} mismatched')
+
+def benchmark_frontier(n: int = 100000):
+    # bfs over n generated urls linking to the next url and 10 random ones, resumed halfway
+    def links(url: str, rng: random.Random) -> list[str]:
+        i = int(url[len('http://localhost/page'):-len('.htm')])
+        return [f'http://localhost/page{j}.htm' for j in [(i + 1) % n] + [rng.randrange(n) for _ in range(10)]]
+
+    def in_memory() -> int:
+        # url_visited, visit_order and the queue of the crawler before the frontier
+        visited, visit_order, queue = set(), dict(), deque(['http://localhost/page0.htm'])
+        rng = random.Random(0)
+        while len(queue) > 0:
+            url = queue.popleft()
+            if url in visited: continue
+            visited.add(url)
+            visit_order[url] = len(visit_order)
+            for link in links(url, rng):
+                if visit_order.get(link, visit_order[url] + 1) > visit_order[url] and len(queue) + len(visited) < n: queue.append(link)
+        return len(visited)
+
+    def on_disk(path: str) -> int:
+        frontier = Frontier(path, max_page=n)
+        frontier.push(['http://localhost/page0.htm'])
+        rng = random.Random(0)
+        crawled, saved = 0, list()
+        while (url := frontier.pop()) is not None:
+            frontier.fetched(url)
+            frontier.done(url, links(url, rng))
+            saved.append(url)
+            if len(saved) >= 100:
+                frontier.saved(saved)
+                saved = list()
+            crawled += 1
+            if crawled == n // 2:
+                frontier.saved(saved)
+                saved = list()
+                frontier.close()
+                frontier = Frontier(path, resume=True, max_page=n)
+        frontier.saved(saved)
+        frontier.close()
+        return crawled
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'frontier.db')
+        for name, crawl in (('in memory', in_memory), ('frontier', lambda: on_disk(path))):
+            tracemalloc.start()
+            start = time.perf_counter()
+            crawled = crawl()
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f'{name}: {crawled} urls in {elapsed:.1f}s ({crawled / elapsed:.0f} urls/s), python heap peak {peak / 1e6:.1f}MB')
+        print(f'frontier file {os.path.getsize(path) / 1e6:.1f}MB')
+
+def serve(n: int = 200, port: int = 8765, changed: int = 0):
+    # the fixed html corpus as a local site to crawl from seed_url = 'http://localhost:{port}/page0.htm'
+    # the first changed pages are replaced by another corpus, to recrawl with incremental_crawl
+    pages = {f'/page{i}.htm': page.encode() for i, page in enumerate(make_pages(n, seed=1)[:changed] + make_pages(n)[changed:])}
+    etags = {path: f'"{sha1(page).hexdigest()}"' for path, page in pages.items()}
+    last_modified = time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime())
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1' # keep-alive
+
+        def do_GET(self):
+            page = pages.get(self.path)
+            if page is None:
+                self.send_error(404)
+                return
+            # the etag is compared first, the date only if no etag is sent
+            etag = self.headers.get('If-None-Match')
+            if (etag == etags[self.path]) if etag is not None else (self.headers.get('If-Modified-Since') == last_modified):
+                self.send_response(304)
+                self.send_header('ETag', etags[self.path])
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(page)))
+            self.send_header('Last-Modified', last_modified)
+            self.send_header('ETag', etags[self.path])
+            self.end_headers()
+            self.wfile.write(page)
+
+        def log_message(self, *args): pass
+
+    print(f'serving {n} pages on http://localhost:{port}/page0.htm')
+    ThreadingHTTPServer(('localhost', port), Handler).serve_forever()
+
+if __name__ == '__main__':
+    benchmarks = {'query': benchmark_query, 'index': benchmark_index, 'parse': benchmark_parse, 'frontier': benchmark_frontier, 'serve': serve}
+    if len(sys.argv) > 1 and sys.argv[1] in benchmarks:
+        benchmarks[sys.argv[1]](*[int(a) for a in sys.argv[2:5]])
+    else:
+        print('usage: python benchmark.py query|index|parse|frontier|serve [n] [port] [changed]')
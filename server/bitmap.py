@@ -0,0 +1,117 @@
+from db.schemas import *
+from db.database import *
+from cache import on_index_change
+import threading
+
+# bitsets are python ints where bit i is set if webpage i is included
+def to_bitset(webpage_ids: Iterable[int]) -> int:
+    webpage_ids = list(webpage_ids)
+    if len(webpage_ids) <= 0: return 0
+    bits = bytearray(max(webpage_ids) // 8 + 1)
+    for i in webpage_ids: bits[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(bits, 'little')
+
+def from_bitset(bitset: int) -> list[int]:
+    return [i for i, c in enumerate(bin(bitset)[:1:-1]) if c == '1']
+
+class BitmapIndex:
+    def __init__(self):
+        self.title: dict[int, int] = dict() # word_id: bitset
+        self.body: dict[int, int] = dict()
+        self.page: dict[int, int] = dict()
+        self.active: int = 0
+        self.crawled: int = 0
+        self.last_modified_dates: dict[int, str] = dict() # webpage_id: date as stored in sqlite
+
+    def load(self, db = Session()):
+        pages = db.query(
+            Webpage.webpage_id, Webpage.is_active, Webpage.is_crawled,
+            cast(Webpage.last_modified_date, String)
+        ).all()
+        self.active = to_bitset([i[0] for i in pages if i[1]])
+        self.crawled = to_bitset([i[0] for i in pages if i[2]])
+        self.last_modified_dates = {i[0]: i[3] for i in pages}
+
+        for bitsets, cls in ((self.title, TitleIndex), (self.body, BodyIndex)):
+            postings: dict[int, list[int]] = dict()
+            for word_id, webpage_id in db.query(cls.word_id, cls.webpage_id).filter(cls.frequency >= 1).all():
+                postings.setdefault(word_id, list()).append(webpage_id)
+            for word_id, webpage_ids in postings.items():
+                bitsets[word_id] = to_bitset(webpage_ids)
+
+        for word_id in set(self.title.keys()).union(self.body.keys()):
+            self.page[word_id] = self.title.get(word_id, 0) | self.body.get(word_id, 0)
+        return self
+
+    def any(self, bitsets: dict[int, int], word_ids: set[int]) -> int:
+        result = 0
+        for i in word_ids: result |= bitsets.get(i, 0)
+        return result
+
+    def all(self, bitsets: dict[int, int], word_ids: set[int]) -> int:
+        result = -1
+        for i in word_ids:
+            result &= bitsets.get(i, 0)
+            if result == 0: break
+        return result
+
+    def query_webpage_id(
+        self,
+        title_any: set[int] = set(),
+        title_all: set[int] = set(),
+        title_not: set[int] = set(),
+        body_any: set[int] = set(),
+        body_all: set[int] = set(),
+        body_not: set[int] = set(),
+        page_any: set[int] = set(),
+        page_all: set[int] = set(),
+        page_not: set[int] = set(),
+        from_date: str | None = None,
+        to_date: str | None = None,
+    ) -> list[int]:
+        # same constraints as query_webpage_id in search.py
+        title_all = title_all.difference(title_not)
+        title_any = title_any.difference(title_all).difference(title_not)
+        body_all = body_all.difference(body_not)
+        body_any = body_any.difference(body_all).difference(body_not)
+        page_all = page_all.difference(page_not)
+        page_any = page_any.difference(page_all).difference(page_not).difference(body_any).difference(body_all).difference(title_any).difference(title_all)
+
+        result = self.active & self.crawled
+        if len(title_any) > 0: result &= self.any(self.title, title_any)
+        if len(title_all) > 0: result &= self.all(self.title, title_all)
+        if len(title_not) > 0: result &= ~self.any(self.title, title_not)
+        if len(body_any) > 0: result &= self.any(self.body, body_any)
+        if len(body_all) > 0: result &= self.all(self.body, body_all)
+        if len(body_not) > 0: result &= ~self.any(self.body, body_not)
+        if len(page_any) > 0: result &= self.any(self.page, page_any)
+        if len(page_all) > 0: result &= self.all(self.page, page_all)
+        if len(page_not) > 0: result &= ~self.any(self.page, page_not)
+
+        webpage_ids = from_bitset(result)
+        if from_date is not None:
+            webpage_ids = [i for i in webpage_ids if self.last_modified_dates[i] is not None and self.last_modified_dates[i] >= from_date]
+        if to_date is not None:
+            webpage_ids = [i for i in webpage_ids if self.last_modified_dates[i] is not None and self.last_modified_dates[i] <= to_date]
+        return webpage_ids
+
+bitmap_index: BitmapIndex | None = None
+bitmap_lock = threading.Lock()
+
+@on_index_change
+def reset_bitmap_index():
+    global bitmap_index
+    bitmap_index = None
+
+def get_bitmap_index() -> BitmapIndex:
+    global bitmap_index
+    if bitmap_index is None:
+        with bitmap_lock:
+            if bitmap_index is None: load_bitmap_index()
+    return bitmap_index
+
+def load_bitmap_index() -> BitmapIndex:
+    global bitmap_index
+    with Session() as db:
+        bitmap_index = BitmapIndex().load(db=db)
+    return bitmap_index
@@ -1,4 +1,6 @@
 from spider import *
+from sparse_index import build_sparse_index
+import sys
 
 def run_bonus_feature():
     db = Session()
@@ -6,9 +8,17 @@ def run_bonus_feature():
     word_ids = set(w[0] for w in word_ids)
     compute_pmi(word_ids)
     compute_pagerank()
+    compute_page_vectors()
+    # saved with the new generation
+    bump_index_generation(db=db)
+    build_sparse_index()
 
 if __name__ == '__main__':
     time_start = time.time()
+    if '--rebuild-df' in sys.argv:
+        with Session() as db: 
+            rebuild_document_frequency(db=db)
+            bump_index_generation(db=db)
     # run_bonus_feature()
     with Session() as db: 
         print(db.query(func.avg(Webpage.pagerank)).scalar())
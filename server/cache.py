@@ -0,0 +1,98 @@
+from collections import OrderedDict
+from functools import wraps
+from hashlib import sha1
+from typing import Any, Callable
+from db.database import *
+from feedback import get_feedback_store
+import inspect
+import json
+import threading
+
+class ResultCache:
+    def __init__(self, max_size: int = result_cache_size):
+        self.entries: OrderedDict[str, Any] = OrderedDict() # least recently used first
+        self.max_size = max_size
+        self.generation: int | None = None
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Any | None:
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key: str, value: Any, generation: int | None):
+        with self.lock:
+            # computed before the index changed
+            if generation != self.generation: return
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size: self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock: self.entries.clear()
+
+    def stats(self) -> dict[str, Any]:
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self.entries),
+                'max_size': self.max_size,
+                'generation': self.generation,
+            }
+
+result_cache = ResultCache()
+generation_lock = threading.Lock()
+reset_callbacks: list[Callable[[], None]] = [reset_document_frequency]
+
+def on_index_change(func: Callable[[], None]) -> Callable[[], None]:
+    # in-memory indexes register their reset here and reload lazily on next use
+    reset_callbacks.append(func)
+    return func
+
+def check_index_generation() -> int:
+    with Session() as db:
+        generation = get_index_generation(db=db)
+    if generation == result_cache.generation: return generation
+
+    with generation_lock:
+        if generation != result_cache.generation:
+            for func in reset_callbacks: func()
+            result_cache.clear()
+            result_cache.generation = generation
+    return generation
+
+def result_key(name: str, arguments: dict[str, Any]) -> str:
+    arguments = dict(arguments)
+    if isinstance(arguments.get('query'), str):
+        arguments['query'] = ' '.join(arguments['query'].lower().split())
+    if arguments.get('session_id') is not None:
+        # feedback sent after the result was cached changes it
+        arguments['feedback_version'] = get_feedback_store().version(arguments['session_id'])
+    # cookies are large, the whole key is fingerprinted
+    return f'{name}:' + sha1(json.dumps(arguments, sort_keys=True, default=str).encode()).hexdigest()
+
+def cached(func: Callable) -> Callable:
+    # cached results are shared between callers and should not be modified
+    signature = inspect.signature(func)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not use_result_cache: return func(*args, **kwargs)
+        generation = check_index_generation()
+        arguments = signature.bind(*args, **kwargs)
+        arguments.apply_defaults()
+        key = result_key(func.__name__, arguments.arguments)
+
+        result = result_cache.get(key)
+        if result is not None: return result
+        result = func(*args, **kwargs)
+        result_cache.put(key, result, generation)
+        return result
+    return wrapper
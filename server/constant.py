@@ -3,12 +3,64 @@ bulk_write_limit = 100
 relationship_limit = 5
 max_thread_worker = 20
 
+# max number of values in a single sql IN clause
+sql_chunk_size = 500
+
+# search scoring backend
+# 'database': one session per candidate page, 'batch': all candidate pages in a few chunked queries,
+# 'index': in-memory inverted index (index.py), 'sparse': sparse doc-term matrix (sparse_index.py)
+scoring_backend = 'database'
+sparse_index_path = './db/sparse_index.npz'
+# resolve advanced search constraints with in-memory bitmaps (bitmap.py) instead of sql subqueries
+use_bitmap_filter = False
+# read page vectors materialized by compute_page_vectors when available
+use_page_vectors = True
+# idf from the document_frequency table cached in memory instead of counting pages per query
+use_document_frequency = True
+# match double quoted phrases with the token positions stored in title_index and body_index
+use_positional_index = True
+# match fuzzy query words with the in-memory n-gram index (fuzzy.py) instead of sql like scans
+use_fuzzy_index = True
+# cache search results until the crawler or bonus jobs bump the index generation (cache.py)
+use_result_cache = True
+result_cache_size = 256
+# webpages loaded from the database at a time in streamed search responses
+stream_chunk_size = 20
+
 # crawler config
 seed_url = 'https://www.cse.ust.hk/~kwtleung/COMP4321/testpage.htm'
 backup_url = 'https://comp4321-hkust.github.io/testpages/testpage.htm'
 max_page = 300
 remove_cyclic_relationship: bool = True
+# processes parsing pages and extracting keywords while crawling, None for the number of cpus
+max_parse_worker: int | None = None
+# crawl with asyncio and pooled keep-alive connections (async_crawl) instead of a thread per fetch
+use_async_crawler: bool = False
+max_connections = 100
+max_host_connections = 10
+fetch_timeout = 30
 delete_unfounded_item: bool = False
+# pages are downloaded in fetch_chunk_size chunks up to max_page_bytes, other content types are not downloaded
+max_page_bytes = 5 * 1024 * 1024
+fetch_chunk_size = 64 * 1024
+crawl_content_types = ['text/html', 'application/xhtml+xml']
+# parser of crawled pages (page_parser.py), 'html.parser', or 'lxml' and 'selectolax' if installed
+html_parser_backend = 'html.parser'
+# crawl state on disk, resume_crawl continues the last crawl into the existing database instead of starting over
+frontier_path = './db/frontier.db'
+resume_crawl: bool = False
+# recrawl into the existing database with conditional requests, pages not modified or with the same html are not reindexed
+incremental_crawl: bool = False
+# record the http responses of a crawl to a WARC file, or replay a recorded crawl without network (warc.py)
+# replay_latency seconds are waited for each replayed response
+record_crawl_path: str | None = None
+replay_crawl_path: str | None = None
+replay_latency = 0.0
+# pages within near_duplicate_distance bits of the simhash of an indexed page are not indexed, at most 3
+detect_near_duplicates: bool = True
+near_duplicate_distance = 3
+# index rake phrases as keywords, phrase queries can be answered by the positional index without them
+index_rake_phrases: bool = True
 
 # search scoring weights
 title_weight = 0.7
@@ -17,7 +69,11 @@ title_weight = 0.7
 relevant_weight = 0.5
 non_relevant_weight = 0.25
 max_relevant_query_considered = 5
+# feedback of sessions kept in memory, the others are reloaded from the database
+max_feedback_sessions = 1000
 max_ranked_words = 5
+# stemmed and tokenized words cached by the query analyzer and the indexing pipeline
+stem_cache_size = 100000
 
 # co occurence
 co_occurence_weight = 0.5
@@ -26,6 +82,8 @@ co_occurence_title_frequency_threshold = 1
 co_occurence_body_frequency_threshold = 3
 pmi_threshold = 0.3
 pmi_title_weight = 0.3
+# expand queries with the in-memory pmi graph (pmi.py) instead of querying the pmi table
+use_pmi_graph = True
 
 # pagerank
 pagerank_damping_factor = 0.85
@@ -33,4 +91,9 @@ pagerank_weight = 0.3
 pagerank_iteration = 20
 
 # fuzzy word matching
-max_fuzzy_word_matching = 5
\ No newline at end of file
+max_fuzzy_word_matching = 5
+
+# autocomplete
+max_autocomplete_words = 10
+# top completions are kept for prefixes up to this length
+autocomplete_cached_prefix_length = 2
\ No newline at end of file
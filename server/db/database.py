@@ -1,13 +1,19 @@
 from concurrent.futures import ThreadPoolExecutor
 from math import log2
-from sqlalchemy import String, Float, create_engine, and_, not_, update, or_, func, delete, select, cast, insert
+from sqlalchemy import String, Float, create_engine, and_, not_, update, or_, func, delete, select, cast, insert, text
+from sqlalchemy import inspect as inspect_db
 from sqlalchemy.orm import sessionmaker, aliased
+from sqlalchemy.schema import CreateIndex
 from constant import *
+from utils import merge_dict, hamming_distance
+from math import sqrt, log10
+from collections import Counter
 
 try: from schemas import *
 except: from .schemas import *
 
-from typing import Any
+from typing import Any, Iterable
+import json
 import sqlalchemy.dialects.sqlite as sqlite
 import threading
 
@@ -17,8 +23,37 @@ Session = sessionmaker(bind=engine) # Create a session to interact with the data
 
 def create_database(restore: bool = False):
     global engine
-    if restore: Base().metadata.drop_all(bind=engine)
+    generation = 0
+    if restore:
+        # the generation outlives the tables, a server must not keep the caches of the dropped ids
+        if inspect_db(engine).has_table(Statistic.__tablename__):
+            with Session() as db: generation = get_index_generation(db=db)
+        Base().metadata.drop_all(bind=engine)
     Base().metadata.create_all(bind=engine)
+    if restore:
+        with Session() as db:
+            db.add(Statistic(name='index_generation', value=generation + 1))
+            db.commit()
+
+    # columns added after the database was created, kept by incremental crawls
+    # positions stay NULL in old index rows, phrase queries match those pages once they are crawled again
+    inspector = inspect_db(engine)
+    columns = {table: {c['name'] for c in inspector.get_columns(table)} for table in ('webpage', 'title_index', 'body_index')}
+    with engine.begin() as conn:
+        for table, name, sql_type in (
+            ('webpage', 'etag', 'VARCHAR(255)'), ('webpage', 'content_hash', 'VARCHAR(64)'), 
+            ('webpage', 'simhash', 'INTEGER'), ('webpage', 'canonical_id', 'INTEGER REFERENCES webpage (webpage_id)'),
+            ('webpage', 'links', 'VARCHAR'),
+            ('title_index', 'positions', 'BLOB'), ('body_index', 'positions', 'BLOB'),
+        ):
+            if name not in columns[table]: conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {name} {sql_type}'))
+        # expression indexes are not reflected by sqlite, so checkfirst cannot be used
+        for index in simhash_indexes: conn.execute(CreateIndex(index, if_not_exists=True))
+
+    # document frequencies are maintained incrementally from a consistent starting point
+    with Session() as db:
+        if db.query(Statistic.value).filter(Statistic.name == 'active_page_count').scalar() is None:
+            rebuild_document_frequency(db=db)
 
 def set_title_index(
     title_indexes: list[TitleIndex], 
@@ -27,6 +62,8 @@ def set_title_index(
     db = Session()) -> None:
     
     for i in title_indexes: i.index_id = f'{i.webpage_id}-{i.word_id}'
+    founded_page = set([i.webpage_id for i in title_indexes])
+    indexed_words = get_indexed_words(TitleIndex, founded_page, db=db)
 
     upsert(
         sess=db, cls=TitleIndex, inputs=title_indexes,
@@ -39,7 +76,6 @@ def set_title_index(
     if delete_unindexed_words:
         where_clause = not_(TitleIndex.index_id.in_([index.index_id for index in title_indexes]))
     else:
-        founded_page = set([i.webpage_id for i in title_indexes])
         where_clause = and_(
             (TitleIndex.webpage_id.in_(founded_page)),
             not_(TitleIndex.index_id.in_([index.index_id for index in title_indexes]))
@@ -49,6 +85,17 @@ def set_title_index(
     db.execute(query)
     db.commit()
 
+    # unindexed words of other pages are deleted as well
+    if delete_unindexed_words: 
+        rebuild_document_frequency(db=db)
+        return
+    
+    active_pages = get_active_pages(founded_page, db=db)
+    new_indexed_words = get_indexed_words(TitleIndex, founded_page, db=db)
+    df = Counter([w for p, w in new_indexed_words.difference(indexed_words) if p in active_pages])
+    df.subtract([w for p, w in indexed_words.difference(new_indexed_words) if p in active_pages])
+    update_document_frequency({True: df}, db=db)
+
 def set_body_index(
     body_indexes: list[BodyIndex], 
     ignore: bool = False,
@@ -56,6 +103,8 @@ def set_body_index(
     db = Session()) -> None:
     
     for i in body_indexes: i.index_id = f'{i.webpage_id}-{i.word_id}'
+    founded_page = set([i.webpage_id for i in body_indexes])
+    indexed_words = get_indexed_words(BodyIndex, founded_page, db=db)
 
     upsert(
         sess=db, cls=BodyIndex, inputs=body_indexes,
@@ -68,7 +117,6 @@ def set_body_index(
     if delete_unindexed_words:
         where_clause = not_(BodyIndex.index_id.in_([index.index_id for index in body_indexes]))
     else:
-        founded_page = set([i.webpage_id for i in body_indexes])
         where_clause = and_(
             (BodyIndex.webpage_id.in_(founded_page)),
             not_(BodyIndex.index_id.in_([index.index_id for index in body_indexes]))
@@ -78,6 +126,17 @@ def set_body_index(
     db.execute(query)
     db.commit()
 
+    # unindexed words of other pages are deleted as well
+    if delete_unindexed_words: 
+        rebuild_document_frequency(db=db)
+        return
+    
+    active_pages = get_active_pages(founded_page, db=db)
+    new_indexed_words = get_indexed_words(BodyIndex, founded_page, db=db)
+    df = Counter([w for p, w in new_indexed_words.difference(indexed_words) if p in active_pages])
+    df.subtract([w for p, w in indexed_words.difference(new_indexed_words) if p in active_pages])
+    update_document_frequency({False: df}, db=db)
+
 def set_keyword(keywords: list[str | Keyword], db = Session()) -> dict[str, int]:
     mapping: list[tuple[int, str]] = upsert(
         sess=db, cls=Keyword, inputs=keywords,
@@ -120,22 +179,318 @@ def set_webpage(
     delete_unfounded_page: bool = False, 
     db = Session()) -> dict[str, int]:
 
+    urls = [page.url for page in webpages]
+    active_pages = get_active_pages(urls=urls, db=db)
     mapping: list[tuple[int, str]] = upsert(
         sess=db, cls=Webpage, inputs=webpages,
         ignore=ignore,
         conflict_items=[Webpage.url],
         returning=(Webpage.webpage_id, Webpage.url)
     )
+    if not ignore:
+        delete_page_vectors([t[0] for t in mapping], db=db)
+        db.commit()
 
     if delete_unfounded_page:
         query = update(Webpage).where(
-            not_(Webpage.url.in_([page.url for page in webpages]))
+            not_(Webpage.url.in_(urls))
         ).values(is_active=False)
         db.execute(query)
         db.commit()
+        rebuild_document_frequency(db=db)
+    else:
+        # words of pages turning active or inactive are counted or discounted
+        new_active_pages = get_active_pages(urls=urls, db=db)
+        added = new_active_pages.difference(active_pages)
+        removed = active_pages.difference(new_active_pages)
+
+        if len(added) > 0 or len(removed) > 0:
+            df = {True: Counter(), False: Counter()}
+            for is_title, cls in ((True, TitleIndex), (False, BodyIndex)):
+                df[is_title].update([w for _, w in get_indexed_words(cls, added, db=db)])
+                df[is_title].subtract([w for _, w in get_indexed_words(cls, removed, db=db)])
+            update_document_frequency(df, page_count=len(added) - len(removed), db=db)
 
     return {t[1]: t[0] for t in mapping}
 
+def set_crawled_pages(
+    pages: list[tuple[dict[str, Any], set[str]]],
+    db = Session()) -> tuple[set[int], set[int]]:
+    # group commit of crawled pages given as (record of extract_record, child links)
+    # same table contents as saving them one by one, in a single transaction of executemany statements
+    pages = list({record['url']: (record, children) for record, children in pages}.values()) # last crawl of a url is kept
+    urls = [record['url'] for record, _ in pages]
+
+    active_pages = get_active_pages(urls=urls, db=db)
+    webpage_ids: dict[str, int] = {t[1]: t[0] for t in bulk_upsert(
+        Webpage, [Webpage.to_basic_dict(Webpage(
+            url=record['url'], title=record['title'], size=record['size'], 
+            last_modified_date=record['last_modified_date'], is_active=True, is_crawled=True,
+            etag=record['etag'], content_hash=record['content_hash'], simhash=record['simhash'],
+            links=json.dumps(record['links']),
+        )) for record, _ in pages],
+        conflict_items=[Webpage.url],
+        returning=(Webpage.webpage_id, Webpage.url), db=db
+    )}
+    delete_page_vectors(webpage_ids.values(), db=db)
+
+    # words of pages turning active are counted
+    active_page_ids = get_active_pages(webpage_ids.values(), db=db)
+    added = active_page_ids.difference(active_pages)
+    df = {True: Counter(), False: Counter()}
+    for is_title, cls in ((True, TitleIndex), (False, BodyIndex)):
+        df[is_title].update([w for _, w in get_indexed_words(cls, added, db=db)])
+
+    # children are inserted as inactive pages if not found, old relationships of the parents are deactivated
+    child_urls = set().union(*[children for _, children in pages])
+    bulk_upsert(
+        Webpage, [Webpage.to_basic_dict(Webpage(url=url, is_crawled=False, is_active=False)) for url in child_urls],
+        conflict_items=[Webpage.url], ignore=True, db=db
+    )
+    child_ids: dict[str, int] = dict()
+    child_urls = list(child_urls)
+    for i in range(0, len(child_urls), sql_chunk_size):
+        child_ids.update(db.query(Webpage.url, Webpage.webpage_id).filter(Webpage.url.in_(child_urls[i: i + sql_chunk_size])).all())
+
+    parents = {webpage_ids[record['url']]: children for record, children in pages if len(children) > 0}
+    db.execute(update(Relationship).where(Relationship.parent_id.in_(parents.keys())).values(is_active=False))
+    bulk_upsert(Relationship, [{
+        'parent_id': parent_id, 'child_id': child_ids[url], 
+        'relate_id': f'{parent_id}-{child_ids[url]}', 'is_active': True,
+    } for parent_id, children in parents.items() for url in children if url in child_ids], conflict_items=[Relationship.relate_id], db=db)
+
+    # keywords and indexes of pages with any keyword, unindexed words of these pages get frequency 0
+    indexed = [(webpage_ids[record['url']], record) for record, _ in pages if len(record['title_keywords']) > 0 or len(record['body_keywords']) > 0]
+    keywords = dict.fromkeys(a[0] for _, record in indexed for key in ('title_keywords', 'body_keywords') for a in record[key])
+    word_id_dict: dict[str, int] = {t[1]: t[0] for t in bulk_upsert(
+        Keyword, [{'word': word} for word in keywords], 
+        conflict_items=[Keyword.word],
+        returning=(Keyword.word_id, Keyword.word), db=db
+    )}
+
+    for is_title, cls, key in ((True, TitleIndex, 'title_keywords'), (False, BodyIndex, 'body_keywords')):
+        indexes = {webpage_id: record[key] for webpage_id, record in indexed if len(record[key]) > 0}
+        if len(indexes) <= 0: continue
+        indexed_words = get_indexed_words(cls, indexes.keys(), db=db)
+        db.execute(update(cls).where(cls.webpage_id.in_(indexes.keys())).values(frequency=0))
+        rows = {f'{webpage_id}-{word_id_dict[word]}': {
+            'index_id': f'{webpage_id}-{word_id_dict[word]}', 'webpage_id': webpage_id, 'word_id': word_id_dict[word],
+            'frequency': freq, 'normalized_tf': normalized_tf, 'positions': positions,
+        } for webpage_id, records in indexes.items() for word, freq, normalized_tf, positions in records}
+        bulk_upsert(cls, list(rows.values()), conflict_items=[cls.index_id], db=db)
+
+        new_indexed_words = {(r['webpage_id'], r['word_id']) for r in rows.values() if r['frequency'] >= 1}
+        df[is_title].update([w for p, w in new_indexed_words.difference(indexed_words) if p in active_page_ids])
+        df[is_title].subtract([w for p, w in indexed_words.difference(new_indexed_words) if p in active_page_ids])
+
+    # commits the whole group
+    update_document_frequency(df, page_count=len(added), db=db)
+    return set(webpage_ids.values()).union(child_ids.values()), set(word_id_dict.values())
+
+def get_near_duplicates(pages: list[tuple[str, int | None]], db = Session()) -> dict[str, str]:
+    # url: url of the indexed page within near_duplicate_distance bits of its simhash
+    # pages are compared with indexed pages and with the earlier pages of the list
+    canonicals: dict[str, str] = dict()
+    indexed: list[tuple[str, int]] = list()
+    for url, fingerprint in pages:
+        if fingerprint is None: continue
+        candidates = db.query(Webpage.url, Webpage.simhash).filter(and_(
+            or_(*[simhash_block(Webpage.simhash, i) == (fingerprint >> 16 * i) & 0xffff for i in range(4)]),
+            Webpage.is_active == True, Webpage.is_crawled == True,
+            Webpage.canonical_id == None, Webpage.url != url,
+        )).order_by(Webpage.webpage_id).all() + indexed
+        canonical = next((u for u, h in candidates if hamming_distance(h, fingerprint) <= near_duplicate_distance), None)
+        if canonical is not None: canonicals[url] = canonical
+        else: indexed.append((url, fingerprint))
+    return canonicals
+
+def set_duplicate_pages(pages: list[tuple[Webpage, str]], db = Session()) -> dict[str, int]:
+    # near duplicates are inactive and refer to their canonical page instead of being indexed
+    canonical_urls = {url for _, url in pages}
+    canonical_ids = dict(db.query(Webpage.url, Webpage.webpage_id).filter(Webpage.url.in_(canonical_urls)).all())
+    webpages = list()
+    for page, url in pages:
+        if url not in canonical_ids: continue
+        page.is_active = False
+        page.canonical_id = canonical_ids[url]
+        webpages.append(page)
+    return set_webpage(webpages, db=db) if len(webpages) > 0 else dict()
+
+def set_inactive_pages(urls: Iterable[str], db = Session()) -> dict[str, int]:
+    # crawled pages keep their rows but are no longer searched, their words are discounted by set_webpage
+    urls = list(urls)
+    mapping: dict[str, int] = dict()
+    for i in range(0, len(urls), sql_chunk_size):
+        webpages = [
+            Webpage(**{**Webpage.to_basic_dict(page), 'is_active': False}) 
+            for page in db.query(Webpage).filter(Webpage.url.in_(urls[i: i + sql_chunk_size])).all()
+        ]
+        if len(webpages) > 0: mapping.update(set_webpage(webpages, db=db))
+    return mapping
+
+def get_active_pages(
+    webpage_ids: Iterable[int] | None = None, 
+    urls: Iterable[str] | None = None, 
+    db = Session()) -> set[int]:
+    # active and crawled pages among the given ids or urls
+    where_clause = [Webpage.is_active == True, Webpage.is_crawled == True]
+    if webpage_ids is not None: where_clause.append(Webpage.webpage_id.in_(webpage_ids))
+    if urls is not None: where_clause.append(Webpage.url.in_(urls))
+    return {i[0] for i in db.query(Webpage.webpage_id).filter(and_(*where_clause)).all()}
+
+def get_crawl_validators(db = Session()) -> dict[str, tuple[Any, str | None, str | None]]:
+    # url: (last modified date, etag, content hash) of the active crawled pages
+    return {i[0]: tuple(i[1:]) for i in db.query(
+        Webpage.url, Webpage.last_modified_date, Webpage.etag, Webpage.content_hash
+    ).filter(and_(Webpage.is_active == True, Webpage.is_crawled == True)).all()}
+
+def get_child_links(db = Session()) -> dict[str, list[str]]:
+    # parent url: all links of its last fetch
+    # relationships leave out the cyclic links, they are used for pages crawled before the links were stored
+    links: dict[str, list[str]] = {i[0]: json.loads(i[1]) for i in db.query(Webpage.url, Webpage.links).filter(and_(
+        Webpage.is_crawled == True, Webpage.links != None
+    )).all()}
+    stored = set(links.keys())
+    child = aliased(Webpage)
+    for parent_url, child_url in db.query(Webpage.url, child.url).join(
+        Relationship, Relationship.parent_id == Webpage.webpage_id
+    ).join(
+        child, Relationship.child_id == child.webpage_id
+    ).filter(Relationship.is_active == True).order_by(Relationship.parent_id, Relationship.child_id).all():
+        if parent_url not in stored: links.setdefault(parent_url, list()).append(child_url)
+    return links
+
+def get_indexed_words(cls, webpage_ids: Iterable[int], db = Session()) -> set[tuple[int, int]]:
+    # (webpage_id, word_id) with non-zero frequency
+    return set(db.query(cls.webpage_id, cls.word_id).filter(and_(
+        cls.webpage_id.in_(webpage_ids),
+        cls.frequency >= 1,
+    )).all())
+
+df_cache: dict[bool, dict[int, int]] | None = None # is_title: word_id: document frequency
+page_count_cache: int = 0
+
+def load_document_frequency(db = Session()) -> dict[bool, dict[int, int]] | None:
+    global df_cache, page_count_cache
+    page_count = db.query(Statistic.value).filter(Statistic.name == 'active_page_count').scalar()
+    if page_count is None: return None
+
+    cache = {True: dict(), False: dict()}
+    for word_id, is_title, frequency in db.query(
+        DocumentFrequency.word_id, DocumentFrequency.is_title, DocumentFrequency.frequency
+    ).filter(DocumentFrequency.frequency > 0).all():
+        cache[is_title][word_id] = frequency
+
+    page_count_cache = int(page_count)
+    df_cache = cache
+    return df_cache
+
+def reset_document_frequency() -> None:
+    # reloaded on next use
+    global df_cache
+    df_cache = None
+
+def update_document_frequency(
+    df: dict[bool, Counter], 
+    page_count: int = 0, 
+    db = Session()) -> None:
+    values = [{
+        'df_id': f'{"title" if is_title else "body"}-{word_id}',
+        'word_id': word_id,
+        'is_title': is_title,
+        'frequency': delta,
+    } for is_title, counter in df.items() for word_id, delta in counter.items() if delta != 0]
+
+    if len(values) > 0:
+        query = sqlite.insert(DocumentFrequency).values(values)
+        query = query.on_conflict_do_update(
+            index_elements=[DocumentFrequency.df_id],
+            set_={'frequency': DocumentFrequency.frequency + query.excluded.frequency}
+        )
+        db.execute(query)
+    if page_count != 0:
+        query = sqlite.insert(Statistic).values(name='active_page_count', value=page_count)
+        query = query.on_conflict_do_update(
+            index_elements=[Statistic.name],
+            set_={'value': Statistic.value + query.excluded.value}
+        )
+        db.execute(query)
+    db.commit()
+
+    global df_cache, page_count_cache
+    if df_cache is None: return
+    page_count_cache += page_count
+    for value in values:
+        counter = df_cache[value['is_title']]
+        counter[value['word_id']] = counter.get(value['word_id'], 0) + value['frequency']
+        if counter[value['word_id']] <= 0: counter.pop(value['word_id'])
+
+def rebuild_document_frequency(db = Session()) -> None:
+    values = []
+    for is_title, cls in ((True, TitleIndex), (False, BodyIndex)):
+        values += [{
+            'df_id': f'{"title" if is_title else "body"}-{i[0]}',
+            'word_id': i[0],
+            'is_title': is_title,
+            'frequency': i[1],
+        } for i in db.query(
+            cls.word_id, func.count(cls.webpage_id)
+        ).join(
+            Webpage, cls.webpage_id == Webpage.webpage_id
+        ).filter(and_(
+            cls.frequency >= 1,
+            Webpage.is_crawled == True,
+            Webpage.is_active == True,
+        )).group_by(cls.word_id).all()]
+    page_count = db.query(func.count(Webpage.webpage_id)).filter(and_(
+        Webpage.is_active == True,
+        Webpage.is_crawled == True
+    )).scalar()
+
+    db.execute(delete(DocumentFrequency))
+    for i in range(0, len(values), bulk_write_limit):
+        db.execute(insert(DocumentFrequency), values[i: i + bulk_write_limit])
+    db.execute(delete(Statistic).where(Statistic.name == 'active_page_count'))
+    db.execute(insert(Statistic).values(name='active_page_count', value=page_count))
+    db.commit()
+    load_document_frequency(db=db)
+
+def get_index_generation(db = Session()) -> int:
+    generation = db.query(Statistic.value).filter(Statistic.name == 'index_generation').scalar()
+    return int(generation) if generation is not None else 0
+
+def bump_index_generation(db = Session()) -> None:
+    # marks the index as changed, so that the search server drops its cached results and in-memory indexes
+    query = sqlite.insert(Statistic).values(name='index_generation', value=1)
+    query = query.on_conflict_do_update(
+        index_elements=[Statistic.name],
+        set_={'value': Statistic.value + 1}
+    )
+    db.execute(query)
+    db.commit()
+
+def get_idf(word_ids: Iterable[int], is_title: bool | None, db = Session()) -> dict[int, float] | None:
+    # same idf as the one computed in compute_tfidf, None if document frequencies are not built
+    if df_cache is None and load_document_frequency(db=db) is None: return None
+    if page_count_cache <= 0: return dict()
+
+    def idf(word_id: int, is_title: bool) -> float | None:
+        df = df_cache[is_title].get(word_id, 0)
+        return log10(page_count_cache / df) if df > 0 else None
+
+    result = dict()
+    for word_id in word_ids:
+        if is_title is not None:
+            v = idf(word_id, is_title)
+            if v is not None: result[word_id] = v
+            continue
+
+        title_idf, body_idf = idf(word_id, True), idf(word_id, False)
+        if title_idf is None and body_idf is None: continue
+        if (title_idf or 0) + (body_idf or 0) <= 0: continue
+        result[word_id] = (title_idf or 0) * title_weight + (body_idf or 0) * (1 - title_weight)
+    return result
+
 # update if exists, insert if not
 def upsert(
     cls, inputs: list[Any], 
@@ -162,6 +517,29 @@ def upsert(
     sess.execute(query)
     sess.commit()
 
+def bulk_upsert(
+    cls, rows: list[dict[str, Any]],
+    conflict_items: list[str],
+    ignore: bool = False,
+    returning: tuple | None = None, db = Session()) -> list[tuple]:
+    # executemany of upsert in groups of bulk_write_limit rows, committed by the caller
+    query = sqlite.insert(cls)
+    if ignore:
+        query = query.on_conflict_do_nothing(index_elements=conflict_items)
+    else:
+        query = query.on_conflict_do_update(
+            index_elements=conflict_items,
+            set_=cls.to_update_dict(query.excluded)
+        )
+    if returning is not None: query = query.returning(*returning)
+
+    # core executemany on the connection of the session, the orm bulk insert would replace nulls with column defaults
+    result = []
+    for i in range(0, len(rows), bulk_write_limit):
+        r = db.connection().execute(query, rows[i: i + bulk_write_limit])
+        if returning is not None: result += r.fetchall()
+    return result
+
 def compute_pagerank(page_ids: list[int] | None = None):
     pagerank: dict[int, float] = dict()
     parent_dict: dict[int, dict[int, int]] = dict() # child id: parent id: child count
@@ -361,6 +739,95 @@ def compute_pmi(word_ids: set[int]) -> list[tuple[int, int, float]]:
         for f in futures: f.result()
     
 
+def combine_weight(title: dict[int, float], body: dict[int, float]) -> dict[int, float]:
+    return merge_dict(
+        a=title, b=body, 
+        func=lambda a, b: (a if a is not None else 0) * title_weight + (b if b is not None else 0) * (1 - title_weight)
+    )
+
+def delete_page_vectors(webpage_ids: Iterable[int], db = Session()):
+    # reindexed or deactivated pages are computed from their indexes until compute_page_vectors runs again
+    webpage_ids = list(webpage_ids)
+    for i in range(0, len(webpage_ids), sql_chunk_size):
+        chunk = webpage_ids[i: i + sql_chunk_size]
+        db.execute(delete(PageWeight).where(PageWeight.webpage_id.in_(chunk)))
+        db.execute(delete(PageNorm).where(PageNorm.webpage_id.in_(chunk)))
+
+def compute_page_vectors(top_n: int = max_ranked_words):
+    # materialize combined title/body tfidf, norm and top terms of each page
+    with Session() as db:
+        idf_n = db.query(func.count(Webpage.webpage_id)).filter(and_(
+            Webpage.is_active == True,
+            Webpage.is_crawled == True
+        )).scalar_subquery()
+        active_pages = {i[0] for i in db.query(Webpage.webpage_id).filter(and_(
+            Webpage.is_active == True,
+            Webpage.is_crawled == True
+        )).all()}
+
+        idfs: dict[bool, dict[int, float]] = dict()
+        tfs: dict[bool, dict[int, dict[int, float]]] = dict() # is_title: webpage_id: word_id: tf
+        for is_title, cls in ((True, TitleIndex), (False, BodyIndex)):
+            idfs[is_title] = {i[0]: i[1] for i in db.query(
+                cls.word_id, func.log(idf_n / func.count(cls.webpage_id))
+            ).join(
+                Webpage, cls.webpage_id == Webpage.webpage_id
+            ).filter(and_(
+                cls.frequency >= 1,
+                Webpage.is_crawled == True,
+                Webpage.is_active == True,
+            )).group_by(cls.word_id).all()}
+
+            tfs[is_title] = dict()
+            for webpage_id, word_id, normalized_tf in db.query(
+                cls.webpage_id, cls.word_id, cls.normalized_tf
+            ).filter(cls.frequency > 0).all():
+                if webpage_id not in active_pages: continue
+                tfs[is_title].setdefault(webpage_id, dict())[word_id] = normalized_tf
+
+        db.execute(delete(PageWeight))
+        db.execute(delete(PageNorm))
+        db.commit()
+
+        weights: list[dict[str, Any]] = []
+        norms: list[dict[str, Any]] = []
+        for webpage_id in active_pages:
+            title_tf = tfs[True].get(webpage_id, dict())
+            body_tf = tfs[False].get(webpage_id, dict())
+            if len(title_tf) <= 0 and len(body_tf) <= 0: continue
+
+            tf = combine_weight(title=title_tf, body=body_tf)
+            tfidf = combine_weight(
+                title={k: v * idfs[True].get(k, 0) for k, v in title_tf.items()},
+                body={k: v * idfs[False].get(k, 0) for k, v in body_tf.items()},
+            )
+            tf_rank = {a[0]: i for i, a in enumerate(sorted(tf.items(), key=lambda a: a[1], reverse=True)[:top_n])}
+            tfidf_rank = {a[0]: i for i, a in enumerate(sorted(tfidf.items(), key=lambda a: a[1], reverse=True)[:top_n])}
+
+            norm = 0
+            for v in tfidf.values(): norm += v ** 2
+            norms.append({'webpage_id': webpage_id, 'norm': sqrt(norm)})
+            weights += [{
+                'weight_id': f'{webpage_id}-{word_id}',
+                'webpage_id': webpage_id,
+                'word_id': word_id,
+                'tf': v,
+                'tfidf': tfidf[word_id],
+                'tf_rank': tf_rank.get(word_id, None),
+                'tfidf_rank': tfidf_rank.get(word_id, None),
+            } for word_id, v in tf.items()]
+
+            if len(norms) >= bulk_write_limit:
+                db.execute(insert(PageWeight), weights)
+                db.execute(insert(PageNorm), norms)
+                db.commit()
+                weights, norms = [], []
+
+        if len(norms) > 0:
+            db.execute(insert(PageWeight), weights)
+            db.execute(insert(PageNorm), norms)
+            db.commit()
+
 def write_webpage_infos(
     limit: int = -1, db = Session(), write_parent: bool = True,
     keyword_limit: int = 10,
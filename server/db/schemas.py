@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Integer, String, DateTime, ForeignKey, Float
+from sqlalchemy import Boolean, Integer, String, DateTime, ForeignKey, Float, LargeBinary, Index, literal
 from sqlalchemy.orm import DeclarativeBase, relationship, mapped_column, Mapped
 from sqlalchemy.sql import func
 from datetime import datetime
@@ -52,6 +52,8 @@ class TitleIndex(Base):
         Integer, ForeignKey('webpage.webpage_id'), index=True, nullable=False)
     normalized_tf: Mapped[float] = mapped_column(Float, nullable=False)
     frequency: Mapped[int] = mapped_column(Integer, nullable=False)
+    # delta encoded token offsets, null for phrases
+    positions: Mapped[bytes] = mapped_column(LargeBinary, nullable=True)
 
     keyword: Mapped['Keyword'] = relationship('Keyword', back_populates='title_indexes')
     webpage: Mapped['Webpage'] = relationship('Webpage', back_populates='title_indexes')
@@ -64,6 +66,7 @@ class TitleIndex(Base):
             'frequency': obj.frequency,
             'index_id': obj.index_id,
             'normalized_tf': obj.normalized_tf,
+            'positions': obj.positions,
         }
     
     @staticmethod
@@ -72,6 +75,7 @@ class TitleIndex(Base):
             'frequency': obj.frequency,
             'index_id': obj.index_id,
             'normalized_tf': obj.normalized_tf,
+            'positions': obj.positions,
         }
     
     def __eq__(self, value):
@@ -92,6 +96,8 @@ class BodyIndex(Base):
         Integer, ForeignKey('webpage.webpage_id'), index=True, nullable=False)
     normalized_tf: Mapped[float] = mapped_column(Float, nullable=False)
     frequency: Mapped[int] = mapped_column(Integer, nullable=False)
+    # delta encoded token offsets, null for phrases
+    positions: Mapped[bytes] = mapped_column(LargeBinary, nullable=True)
 
     keyword: Mapped['Keyword'] = relationship('Keyword', back_populates='body_indexes')
     webpage: Mapped['Webpage'] = relationship('Webpage', back_populates='body_indexes')
@@ -104,6 +110,7 @@ class BodyIndex(Base):
             'frequency': obj.frequency,
             'index_id': obj.index_id,
             'normalized_tf': obj.normalized_tf,
+            'positions': obj.positions,
         }
     
     @staticmethod
@@ -112,6 +119,7 @@ class BodyIndex(Base):
             'frequency': obj.frequency,
             'index_id': obj.index_id,
             'normalized_tf': obj.normalized_tf,
+            'positions': obj.positions,
         }
     
     def __eq__(self, value):
@@ -134,6 +142,14 @@ class Webpage(Base):
     pagerank: Mapped[float] = mapped_column(Float, nullable=True, default=1.0)
     is_active: Mapped[bool] = mapped_column(Boolean, nullable=False)
     is_crawled: Mapped[bool] = mapped_column(Boolean, nullable=False)
+    # etag of the last fetch and hash of its html, unchanged pages are skipped by incremental crawls
+    etag: Mapped[str] = mapped_column(String(length=255), nullable=True)
+    content_hash: Mapped[str] = mapped_column(String(length=64), nullable=True)
+    # 64 bit simhash of the body keywords, a near duplicate page is inactive and refers to the indexed page
+    simhash: Mapped[int] = mapped_column(Integer, nullable=True)
+    canonical_id: Mapped[int] = mapped_column(Integer, ForeignKey('webpage.webpage_id'), nullable=True)
+    # json [url], all links of the last fetch, queued again when an incremental crawl skips the unchanged page
+    links: Mapped[str] = mapped_column(String, nullable=True)
 
     children: Mapped[list['Webpage']] = relationship(
         'Webpage', secondary=Relationship.__table__,
@@ -167,6 +183,11 @@ class Webpage(Base):
             'pagerank': obj.pagerank,
             'is_active': obj.is_active,
             'is_crawled': obj.is_crawled,
+            'etag': obj.etag,
+            'content_hash': obj.content_hash,
+            'simhash': obj.simhash,
+            'canonical_id': obj.canonical_id,
+            'links': obj.links,
         }
     
     @staticmethod
@@ -180,6 +201,13 @@ class Webpage(Base):
     def __hash__(self):
         return hash(self.url)
 
+def simhash_block(simhash, i: int):
+    # 16 bit block i of a simhash, simhashes within 3 bits share at least one of the 4 blocks
+    # numbers rendered inline, so that queries match the expression indexes
+    return simhash.op('>>')(literal(16 * i, literal_execute=True)).op('&')(literal(0xffff, literal_execute=True))
+
+simhash_indexes = [Index(f'ix_webpage_simhash_{i}', simhash_block(Webpage.__table__.c.simhash, i)) for i in range(4)]
+
 class Keyword(Base):
     __tablename__ = "keyword"
 
@@ -239,4 +267,144 @@ class PMI(Base):
             'pmi': obj.pmi,
         }
 
-    
\ No newline at end of file
+    
+class PageWeight(Base):
+    __tablename__ = 'page_weight'
+
+    weight_id: Mapped[str] = mapped_column(
+        String(length=255), primary_key=True, unique=True, nullable=False)
+    webpage_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey('webpage.webpage_id'), index=True, nullable=False)
+    word_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey('keyword.word_id'), index=True, nullable=False)
+    tf: Mapped[float] = mapped_column(Float, nullable=False)
+    tfidf: Mapped[float] = mapped_column(Float, nullable=False)
+    tf_rank: Mapped[int] = mapped_column(Integer, nullable=True)
+    tfidf_rank: Mapped[int] = mapped_column(Integer, nullable=True)
+
+    @staticmethod
+    def to_basic_dict(obj: Any) -> dict[str, Any]:
+        return {
+            'weight_id': obj.weight_id,
+            'webpage_id': obj.webpage_id,
+            'word_id': obj.word_id,
+            'tf': obj.tf,
+            'tfidf': obj.tfidf,
+            'tf_rank': obj.tf_rank,
+            'tfidf_rank': obj.tfidf_rank,
+        }
+    
+    @staticmethod
+    def to_update_dict(obj: Any) -> dict[str, Any]:
+        return {
+            'tf': obj.tf,
+            'tfidf': obj.tfidf,
+            'tf_rank': obj.tf_rank,
+            'tfidf_rank': obj.tfidf_rank,
+        }
+
+class PageNorm(Base):
+    __tablename__ = 'page_norm'
+
+    webpage_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey('webpage.webpage_id'), primary_key=True, unique=True, nullable=False)
+    norm: Mapped[float] = mapped_column(Float, nullable=False)
+
+    @staticmethod
+    def to_basic_dict(obj: Any) -> dict[str, Any]:
+        return {
+            'webpage_id': obj.webpage_id,
+            'norm': obj.norm,
+        }
+    
+    @staticmethod
+    def to_update_dict(obj: Any) -> dict[str, Any]:
+        return {
+            'norm': obj.norm,
+        }
+
+class DocumentFrequency(Base):
+    __tablename__ = 'document_frequency'
+
+    df_id: Mapped[str] = mapped_column(
+        String(length=255), primary_key=True, unique=True, nullable=False)
+    word_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey('keyword.word_id'), index=True, nullable=False)
+    is_title: Mapped[bool] = mapped_column(Boolean, nullable=False)
+    frequency: Mapped[int] = mapped_column(Integer, nullable=False)
+
+    @staticmethod
+    def to_basic_dict(obj: Any) -> dict[str, Any]:
+        return {
+            'df_id': obj.df_id,
+            'word_id': obj.word_id,
+            'is_title': obj.is_title,
+            'frequency': obj.frequency,
+        }
+    
+    @staticmethod
+    def to_update_dict(obj: Any) -> dict[str, Any]:
+        return {
+            'frequency': obj.frequency,
+        }
+
+class Statistic(Base):
+    __tablename__ = 'statistic'
+
+    name: Mapped[str] = mapped_column(
+        String(length=255), primary_key=True, unique=True, nullable=False)
+    value: Mapped[float] = mapped_column(Float, nullable=False)
+
+    @staticmethod
+    def to_basic_dict(obj: Any) -> dict[str, Any]:
+        return {
+            'name': obj.name,
+            'value': obj.value,
+        }
+    
+    @staticmethod
+    def to_update_dict(obj: Any) -> dict[str, Any]:
+        return {
+            'value': obj.value,
+        }
+
+class Feedback(Base):
+    __tablename__ = 'feedback'
+
+    feedback_id: Mapped[str] = mapped_column(
+        String(length=255), primary_key=True, unique=True, nullable=False) # session_id-history_index
+    session_id: Mapped[str] = mapped_column(
+        String(length=255), index=True, nullable=False)
+    history_index: Mapped[int] = mapped_column(Integer, nullable=False)
+    query: Mapped[str] = mapped_column(String, nullable=True)
+    # json {word_id: weight}, the query vector is normalized to unit length
+    query_vector: Mapped[str] = mapped_column(String, nullable=False)
+    relevant_terms: Mapped[str] = mapped_column(String, nullable=False)
+    non_relevant_terms: Mapped[str] = mapped_column(String, nullable=False)
+    relevant_n: Mapped[float] = mapped_column(Float, nullable=False)
+    non_relevant_n: Mapped[float] = mapped_column(Float, nullable=False)
+
+    @staticmethod
+    def to_basic_dict(obj: Any) -> dict[str, Any]:
+        return {
+            'feedback_id': obj.feedback_id,
+            'session_id': obj.session_id,
+            'history_index': obj.history_index,
+            'query': obj.query,
+            'query_vector': obj.query_vector,
+            'relevant_terms': obj.relevant_terms,
+            'non_relevant_terms': obj.non_relevant_terms,
+            'relevant_n': obj.relevant_n,
+            'non_relevant_n': obj.non_relevant_n,
+        }
+    
+    @staticmethod
+    def to_update_dict(obj: Any) -> dict[str, Any]:
+        return {
+            'query': obj.query,
+            'query_vector': obj.query_vector,
+            'relevant_terms': obj.relevant_terms,
+            'non_relevant_terms': obj.non_relevant_terms,
+            'relevant_n': obj.relevant_n,
+            'non_relevant_n': obj.non_relevant_n,
+        }
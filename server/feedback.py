@@ -0,0 +1,152 @@
+from collections import OrderedDict
+from hashlib import sha1
+from math import sqrt
+from typing import Any
+from db.schemas import *
+from db.database import *
+import json
+import threading
+
+class FeedbackEntry:
+    # one searched query of a session with the relevance given to its webpages
+    def __init__(
+        self,
+        query: str | None,
+        vector: dict[int, float], # word_id: weight, unit length
+        relevant_terms: dict[int, float], # word_id: sum of tfidf * relevance
+        non_relevant_terms: dict[int, float],
+        relevant_n: float, # sum of relevance
+        non_relevant_n: float,
+    ):
+        self.query = query
+        self.vector = vector
+        self.relevant_terms = relevant_terms
+        self.non_relevant_terms = non_relevant_terms
+        self.relevant_n = relevant_n
+        self.non_relevant_n = non_relevant_n
+
+    @staticmethod
+    def from_history(history: dict[str, Any]):
+        # history is the same as a cookie sent to /search
+        vector = {v[0]: v[1] for v in history.get('modified_query_vector', dict()).values()}
+        norm = sqrt(sum(v ** 2 for v in vector.values()))
+        vector = {k: v / norm for k, v in vector.items()} if norm != 0 else dict()
+
+        relevant_terms, non_relevant_terms = dict(), dict()
+        relevant_n, non_relevant_n = 0, 0
+        for page in history.get('webpages', list()):
+            relevance = page['relevance']
+            if relevance == 0: continue
+            elif relevance > 0: relevant_n += relevance
+            else: non_relevant_n += abs(relevance)
+            terms = relevant_terms if relevance > 0 else non_relevant_terms
+            for _, word_id, tfidf in page['top_tfidfs']:
+                terms[word_id] = terms.get(word_id, 0) + tfidf * relevance
+        return FeedbackEntry(history.get('query', None), vector, relevant_terms, non_relevant_terms, relevant_n, non_relevant_n)
+
+    @staticmethod
+    def from_row(row: Feedback):
+        def to_terms(s: str) -> dict[int, float]: return {int(k): v for k, v in json.loads(s).items()}
+        return FeedbackEntry(
+            row.query, to_terms(row.query_vector),
+            to_terms(row.relevant_terms), to_terms(row.non_relevant_terms),
+            row.relevant_n, row.non_relevant_n
+        )
+
+    def digest(self) -> str:
+        # the same for an entry reloaded from its row
+        return sha1(json.dumps([
+            self.query, self.vector, self.relevant_terms, self.non_relevant_terms,
+            float(self.relevant_n), float(self.non_relevant_n), # float columns
+        ], sort_keys=True).encode()).hexdigest()
+
+    def to_row(self, session_id: str, index: int) -> Feedback:
+        return Feedback(
+            feedback_id=f'{session_id}-{index}', session_id=session_id, history_index=index, query=self.query,
+            query_vector=json.dumps(self.vector),
+            relevant_terms=json.dumps(self.relevant_terms),
+            non_relevant_terms=json.dumps(self.non_relevant_terms),
+            relevant_n=self.relevant_n, non_relevant_n=self.non_relevant_n,
+        )
+
+class FeedbackSession:
+    def __init__(self):
+        self.entries: dict[int, FeedbackEntry] = dict() # history index: entry
+        # word_id: {history index: normalized weight}, only entries sharing a word with a query are visited
+        self.postings: dict[int, dict[int, float]] = dict()
+        # fingerprint of the entries, kept by an evicted and reloaded session unlike a counter
+        self.version = sha1().hexdigest()
+        self.digests: dict[int, str] = dict() # history index: digest of its entry
+
+    def set(self, index: int, entry: FeedbackEntry):
+        if index in self.entries:
+            for word_id in self.entries[index].vector.keys():
+                self.postings[word_id].pop(index, None)
+                if len(self.postings[word_id]) <= 0: del self.postings[word_id]
+        self.entries[index] = entry
+        for word_id, weight in entry.vector.items():
+            self.postings.setdefault(word_id, dict())[index] = weight
+        self.digests[index] = entry.digest()
+        self.version = sha1(json.dumps(sorted(self.digests.items())).encode()).hexdigest()
+
+    def similarities(self, qtfidf: dict[int, float]) -> dict[int, float]:
+        # history index: cosine similarity rounded as compute_relevance_feedback, missing entries are 0
+        norm = sqrt(sum(v ** 2 for v in qtfidf.values()))
+        if norm == 0: return dict()
+        dots: dict[int, float] = dict()
+        for word_id, weight in qtfidf.items():
+            for index, v in self.postings.get(word_id, dict()).items():
+                dots[index] = dots.get(index, 0) + weight * v
+        return {i: round(v / norm, 3) for i, v in dots.items()}
+
+    def nearest(self, qtfidf: dict[int, float], k: int = max_relevant_query_considered) -> list[tuple[float, list[FeedbackEntry]]]:
+        # top k distinct positive similarities with their entries in history order
+        groups: dict[float, list[FeedbackEntry]] = dict()
+        for index, similarity in sorted(self.similarities(qtfidf).items()):
+            groups.setdefault(similarity, list()).append(self.entries[index])
+        return [i for i in sorted(groups.items(), key=lambda kv: kv[0], reverse=True)[:k] if i[0] > 0]
+
+class FeedbackStore:
+    def __init__(self, max_sessions: int = max_feedback_sessions):
+        self.sessions: OrderedDict[str, FeedbackSession] = OrderedDict() # least recently used first
+        self.max_sessions = max_sessions
+        self.lock = threading.Lock()
+
+    def get(self, session_id: str) -> FeedbackSession:
+        with self.lock:
+            if session_id in self.sessions:
+                self.sessions.move_to_end(session_id)
+                return self.sessions[session_id]
+
+        session = FeedbackSession()
+        with Session() as db:
+            for row in db.query(Feedback).filter(Feedback.session_id == session_id).order_by(Feedback.history_index).all():
+                session.set(row.history_index, FeedbackEntry.from_row(row))
+
+        with self.lock:
+            # loaded by another request in the meantime
+            if session_id in self.sessions: return self.sessions[session_id]
+            self.sessions[session_id] = session
+            while len(self.sessions) > self.max_sessions: self.sessions.popitem(last=False)
+        return session
+
+    def put(self, session_id: str, histories: dict[int, dict[str, Any]]):
+        entries = {i: FeedbackEntry.from_history(h) for i, h in histories.items()}
+        if len(entries) <= 0: return
+        with Session() as db:
+            upsert(Feedback, [e.to_row(session_id, i) for i, e in entries.items()], ['feedback_id'], sess=db)
+        session = self.get(session_id)
+        with self.lock:
+            for i, e in entries.items(): session.set(i, e)
+
+    def nearest(self, session_id: str, qtfidf: dict[int, float]) -> list[tuple[float, list[FeedbackEntry]]]:
+        session = self.get(session_id)
+        with self.lock: return session.nearest(qtfidf)
+
+    def version(self, session_id: str) -> str:
+        return self.get(session_id).version
+
+feedback_store = FeedbackStore()
+
+def get_feedback_store() -> FeedbackStore:
+    return feedback_store
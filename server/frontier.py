@@ -0,0 +1,128 @@
+from typing import Callable, Iterable
+from constant import *
+import sqlite3
+import threading
+
+# states of a url in the frontier
+queued, fetching, fetched, failed, saved = range(5)
+
+class Frontier:
+    # crawl state on disk instead of python sets and queues, so that it can be resumed and does not grow in memory
+    # urls are deduplicated when they are queued, each url is fetched at most once
+    # only urls passing accept are queued, e.g. the urls of the archive while replaying
+    def __init__(
+        self, path: str = frontier_path, resume: bool = False, max_page: int = max_page,
+        accept: Callable[[str], bool] | None = None,
+    ):
+        # its own database file, queueing links never waits for the transactions of the index writer
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS frontier (
+            queue_order INTEGER PRIMARY KEY AUTOINCREMENT,
+            url TEXT UNIQUE NOT NULL,
+            state INTEGER NOT NULL,
+            fetch_order INTEGER
+        )''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS frontier_state ON frontier (state, queue_order)')
+        if resume:
+            # pages not saved when the crawl stopped are fetched again
+            self.db.execute(
+                'UPDATE frontier SET state = ?, fetch_order = NULL WHERE state IN (?, ?)',
+                (queued, fetching, fetched)
+            )
+        else: self.db.execute('DELETE FROM frontier')
+        self.db.commit()
+
+        self.lock = threading.Condition()
+        self.max_page = max_page
+        self.accept = accept
+        self.queued_count = self.count(queued)
+        # page count, pages fetched before they failed to be parsed keep their fetch order and count as well
+        self.fetched_count = self.db.execute(
+            'SELECT COUNT(*) FROM frontier WHERE state = ? OR (state = ? AND fetch_order IS NOT NULL)', (saved, failed)
+        ).fetchone()[0]
+        self.next_order = (self.db.execute('SELECT MAX(fetch_order) FROM frontier').fetchone()[0] or 0) + 1
+        self.in_flight = 0 # popped urls not done yet
+
+    def count(self, state: int) -> int:
+        return self.db.execute('SELECT COUNT(*) FROM frontier WHERE state = ?', (state,)).fetchone()[0]
+
+    def push(self, urls: Iterable[str]):
+        # new urls are queued while queued and fetched pages are fewer than max_page
+        with self.lock:
+            for url in urls:
+                if self.queued_count + self.fetched_count >= self.max_page: break
+                if self.accept is not None and not self.accept(url): continue
+                if self.db.execute('INSERT OR IGNORE INTO frontier (url, state) VALUES (?, ?)', (url, queued)).rowcount > 0:
+                    self.queued_count += 1
+            self.db.commit()
+            self.lock.notify_all()
+
+    def pop(self, max_in_flight: int | None = None) -> str | None:
+        # next queued url in bfs order, None if there is none for now
+        with self.lock:
+            # pages in flight may still be fetched, so no more than max_page pages are fetched
+            if self.fetched_count + self.in_flight >= self.max_page: return None
+            if max_in_flight is not None and self.in_flight >= max_in_flight: return None
+            row = self.db.execute(
+                'SELECT queue_order, url FROM frontier WHERE state = ? ORDER BY queue_order LIMIT 1', (queued,)
+            ).fetchone()
+            if row is None: return None
+            self.db.execute('UPDATE frontier SET state = ? WHERE queue_order = ?', (fetching, row[0]))
+            self.db.commit()
+            self.queued_count -= 1
+            self.in_flight += 1
+            return row[1]
+
+    def next(self, max_in_flight: int | None = None) -> str | None:
+        # blocking pop, None once nothing is queued or in flight
+        with self.lock:
+            while (url := self.pop(max_in_flight)) is None:
+                if self.in_flight <= 0: return None
+                self.lock.wait()
+            return url
+
+    def fetched(self, url: str):
+        with self.lock:
+            self.db.execute('UPDATE frontier SET state = ?, fetch_order = ? WHERE url = ?', (fetched, self.next_order, url))
+            self.db.commit()
+            self.next_order += 1
+            self.fetched_count += 1
+
+    def failed(self, url: str):
+        with self.lock:
+            self.db.execute('UPDATE frontier SET state = ? WHERE url = ?', (failed, url))
+            self.db.commit()
+
+    def done(self, url: str, links: list[str] = list()) -> set[str]:
+        # the page is no longer in flight, its links are its children and queued except those fetched before it
+        with self.lock:
+            child_links = set(links)
+            if remove_cyclic_relationship and len(child_links) > 0:
+                order = self.db.execute('SELECT fetch_order FROM frontier WHERE url = ?', (url,)).fetchone()[0]
+                orders: dict[str, int] = dict()
+                chunks = list(child_links)
+                for i in range(0, len(chunks), sql_chunk_size):
+                    chunk = chunks[i: i + sql_chunk_size]
+                    orders.update(self.db.execute(
+                        f'SELECT url, fetch_order FROM frontier WHERE fetch_order IS NOT NULL AND url IN ({",".join("?" * len(chunk))})',
+                        chunk
+                    ).fetchall())
+                child_links = {link for link in child_links if orders.get(link, order + 1) > order}
+            self.push([link for link in links if link in child_links])
+            self.in_flight -= 1
+            self.lock.notify_all()
+            return child_links
+
+    def saved(self, urls: Iterable[str]):
+        # checkpoint of the pages written to the index
+        with self.lock:
+            self.db.executemany('UPDATE frontier SET state = ? WHERE url = ?', [(saved, url) for url in urls])
+            self.db.commit()
+
+    def failed_urls(self) -> set[str]:
+        return {row[0] for row in self.db.execute('SELECT url FROM frontier WHERE state = ?', (failed,)).fetchall()}
+
+    def close(self):
+        with self.lock: self.db.close()
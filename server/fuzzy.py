@@ -0,0 +1,56 @@
+from array import array
+from db.schemas import *
+from db.database import *
+from cache import on_index_change
+import threading
+
+def to_grams(word: str, max_length: int = 3) -> set[str]:
+    return {word[i:i + n] for n in range(1, max_length + 1) for i in range(len(word) - n + 1)}
+
+class FuzzyIndex:
+    def __init__(self):
+        self.words: dict[int, str] = dict() # word_id: word
+        # character n-grams up to trigrams: sorted word ids of the keywords containing it
+        self.grams: dict[str, array] = dict()
+
+    def load(self, db = Session()):
+        for word_id, word in db.query(Keyword.word_id, Keyword.word).order_by(Keyword.word_id).all():
+            self.words[word_id] = word
+            for gram in to_grams(word):
+                if gram not in self.grams: self.grams[gram] = array('i')
+                self.grams[gram].append(word_id)
+        return self
+
+    def match(self, substring: str) -> list[int]:
+        # ids of keywords containing the substring in word id order, same as Keyword.word.like('%substring%')
+        if len(substring) <= 0: return list(self.words.keys())
+        if len(substring) <= 3: return list(self.grams.get(substring, list()))
+
+        grams = sorted(to_grams(substring).difference(to_grams(substring, 2)), key=lambda g: len(self.grams.get(g, list())))
+        candidates = set(self.grams.get(grams[0], list()))
+        for gram in grams[1:]:
+            if len(candidates) <= 0: break
+            candidates.intersection_update(self.grams.get(gram, list()))
+        # trigrams may be found in a different order
+        return sorted(i for i in candidates if substring in self.words[i])
+
+fuzzy_index: FuzzyIndex | None = None
+fuzzy_lock = threading.Lock()
+
+@on_index_change
+def reset_fuzzy_index():
+    global fuzzy_index
+    fuzzy_index = None
+
+def get_fuzzy_index() -> FuzzyIndex:
+    global fuzzy_index
+    if fuzzy_index is None:
+        with fuzzy_lock:
+            if fuzzy_index is None: load_fuzzy_index()
+    return fuzzy_index
+
+def load_fuzzy_index() -> FuzzyIndex:
+    global fuzzy_index
+    with Session() as db:
+        fuzzy_index = FuzzyIndex().load(db=db)
+    return fuzzy_index
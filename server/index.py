@@ -0,0 +1,222 @@
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+from math import log10, sqrt
+from typing import Any, Callable
+import heapq
+from db.schemas import *
+from db.database import *
+from cache import on_index_change
+import threading
+
+IndexedPage = namedtuple('IndexedPage', ['webpage_id', 'url', 'title', 'last_modified_date', 'size', 'pagerank'])
+
+class InvertedIndex:
+    def __init__(self):
+        self.words: dict[int, str] = dict() # word_id: word
+        self.word_ids: dict[str, int] = dict() # word: word_id
+        self.pages: dict[int, IndexedPage] = dict() # active and crawled pages only
+        self.parents: dict[int, list[str]] = dict()
+        self.children: dict[int, list[str]] = dict()
+        self.min_pagerank: float = 0
+        self.max_pagerank: float = 0
+
+        # is_title: word_id: (sorted webpage ids, normalized tf)
+        self.postings: dict[bool, dict[int, tuple[array, array]]] = {True: dict(), False: dict()}
+        # is_title: webpage_id: (word ids, normalized tf)
+        self.forward: dict[bool, dict[int, tuple[array, array]]] = {True: dict(), False: dict()}
+        self.idfs: dict[bool, dict[int, float]] = {True: dict(), False: dict()}
+
+        # word_id: (sorted webpage ids, combined tfidf divided by the page norm), used for top-k pruning
+        self.weights: dict[int, tuple[array, array]] = dict()
+        self.max_weights: dict[int, float] = dict()
+
+    def load(self, db = Session()):
+        for word_id, word in db.query(Keyword.word_id, Keyword.word).all():
+            self.words[word_id] = word
+            self.word_ids[word] = word_id
+
+        self.max_pagerank, self.min_pagerank = db.query(func.max(Webpage.pagerank), func.min(Webpage.pagerank)).first()
+        urls: dict[int, str] = dict()
+        for page in db.query(
+            Webpage.webpage_id, Webpage.url, Webpage.title, Webpage.last_modified_date,
+            Webpage.size, Webpage.pagerank, Webpage.is_active, Webpage.is_crawled
+        ).all():
+            urls[page[0]] = page[1]
+            if page[6] and page[7]: self.pages[page[0]] = IndexedPage(*page[:6])
+
+        for parent_id, child_id in db.query(Relationship.parent_id, Relationship.child_id).filter(
+            Relationship.is_active == True
+        ).all():
+            if parent_id in self.pages and child_id in self.pages:
+                children = self.children.setdefault(parent_id, list())
+                if len(children) < relationship_limit: children.append(urls[child_id])
+                parents = self.parents.setdefault(child_id, list())
+                if len(parents) < relationship_limit: parents.append(urls[parent_id])
+
+        for is_title, cls in ((True, TitleIndex), (False, BodyIndex)):
+            postings: dict[int, list[tuple[int, float]]] = dict()
+            forward = self.forward[is_title]
+
+            # rows are kept in table order, which is the order of the per-page query in get_webpage_info
+            for webpage_id, word_id, normalized_tf in db.query(
+                cls.webpage_id, cls.word_id, cls.normalized_tf
+            ).filter(cls.frequency > 0).all():
+                if webpage_id not in self.pages: continue
+                if webpage_id not in forward: forward[webpage_id] = (array('i'), array('d'))
+                forward[webpage_id][0].append(word_id)
+                forward[webpage_id][1].append(normalized_tf)
+                postings.setdefault(word_id, list()).append((webpage_id, normalized_tf))
+
+            for word_id, posting in postings.items():
+                posting.sort()
+                self.postings[is_title][word_id] = (
+                    array('i', [p[0] for p in posting]),
+                    array('d', [p[1] for p in posting]),
+                )
+                # same as compute_tfidf, where sqlite log() is base 10
+                self.idfs[is_title][word_id] = log10(len(self.pages) / len(posting))
+
+        weights: dict[int, tuple[array, array]] = dict()
+        for webpage_id in sorted(self.pages.keys()):
+            tfidfs = combine_weight(
+                title=self.compute_tfidf(self.get_tf(webpage_id, is_title=True), is_title=True),
+                body=self.compute_tfidf(self.get_tf(webpage_id, is_title=False), is_title=False),
+            )
+            norm = sqrt(sum(v ** 2 for v in tfidfs.values()))
+            if norm == 0: continue
+            for word_id, v in tfidfs.items():
+                if word_id not in weights: weights[word_id] = (array('i'), array('d'))
+                weights[word_id][0].append(webpage_id)
+                weights[word_id][1].append(v / norm)
+
+        self.weights = weights
+        self.max_weights = {k: max(v[1]) for k, v in weights.items()}
+        return self
+
+    def get_tf(self, webpage_id: int, is_title: bool) -> dict[int, float]:
+        if webpage_id not in self.forward[is_title]: return dict()
+        word_ids, tfs = self.forward[is_title][webpage_id]
+        return dict(zip(word_ids, tfs))
+
+    def compute_tfidf(self, tf: dict[int, float], is_title: bool | None) -> dict[int, float]:
+        if len(tf) <= 0: return dict()
+        if is_title is not None:
+            idfs = self.idfs[is_title]
+            return {word: index * idfs.get(word, 0) for word, index in tf.items()}
+
+        title_idfs, body_idfs = self.idfs[True], self.idfs[False]
+        result = dict()
+        for word in tf.keys():
+            if word not in title_idfs and word not in body_idfs: continue
+            idf = title_idfs.get(word, 0) * title_weight + body_idfs.get(word, 0) * (1 - title_weight)
+            if title_idfs.get(word, 0) + body_idfs.get(word, 0) > 0: result[word] = idf
+        return {word: index * result.get(word, 0) for word, index in tf.items()}
+
+    def normalized_pagerank(self, webpage_id: int) -> float:
+        if self.max_pagerank == self.min_pagerank: return 0
+        return (self.pages[webpage_id].pagerank - self.min_pagerank) / (self.max_pagerank - self.min_pagerank)
+
+    def top_k(
+        self,
+        query_tfidfs: dict[int, float],
+        candidates: set[int],
+        k: int,
+        evaluate: Callable[[int], tuple[dict[str, Any], float] | None],
+    ) -> list[tuple[dict[str, Any], float]]:
+        # WAND over the query terms with positive weight, scored the same as modified_score:
+        # cosine similarity * (1 - pagerank_weight) + normalized pagerank * pagerank_weight
+        if k <= 0: return list()
+        query_norm = sqrt(sum(v ** 2 for v in query_tfidfs.values()))
+        if query_norm == 0: query_norm = 1
+
+        terms = [w for w, v in query_tfidfs.items() if v > 0 and w in self.weights]
+        upper_bounds = {
+            w: query_tfidfs[w] / query_norm * self.max_weights[w] * (1 - pagerank_weight) for w in terms
+        }
+        pagerank_bound = pagerank_weight * max(
+            [self.normalized_pagerank(i) for i in candidates if i in self.pages], default=0
+        )
+
+        heap: list[tuple[float, int, tuple[dict[str, Any], float]]] = []
+        def threshold() -> float:
+            return heap[0][0] if len(heap) >= k else float('-inf')
+
+        def push(webpage_id: int):
+            result = evaluate(webpage_id)
+            if result is None: return
+            if len(heap) < k: heapq.heappush(heap, (result[1], -webpage_id, result))
+            elif result[1] > heap[0][0]: heapq.heapreplace(heap, (result[1], -webpage_id, result))
+
+        cursors = {w: 0 for w in terms}
+        def current(w: int) -> int:
+            postings = self.weights[w][0]
+            return postings[cursors[w]] if cursors[w] < len(postings) else -1
+
+        while True:
+            active = sorted([w for w in terms if current(w) >= 0], key=current)
+            if len(active) <= 0: break
+
+            # pivot: first term where the accumulated upper bound can beat the current threshold
+            pivot = None
+            bound = pagerank_bound
+            for w in active:
+                bound += upper_bounds[w]
+                if bound > threshold():
+                    pivot = w
+                    break
+            if pivot is None: break
+
+            pivot_page = current(pivot)
+            if current(active[0]) == pivot_page:
+                if pivot_page in candidates:
+                    # exact bound of the page before the full evaluation
+                    page_bound = pagerank_weight * self.normalized_pagerank(pivot_page)
+                    for w in active:
+                        if current(w) != pivot_page: break
+                        page_bound += query_tfidfs[w] / query_norm * self.weights[w][1][cursors[w]] * (1 - pagerank_weight)
+                    if page_bound > threshold(): push(pivot_page)
+                for w in active:
+                    if current(w) != pivot_page: break
+                    cursors[w] += 1
+            else:
+                # skip the terms before the pivot to the pivot page
+                for w in active:
+                    if w == pivot: break
+                    cursors[w] = bisect_left(self.weights[w][0], pivot_page, lo=cursors[w])
+
+        # pages without any positively weighted term can only score by pagerank
+        if pagerank_bound <= threshold(): return [a[2] for a in sorted(heap, reverse=True)]
+        posted: set[int] = set()
+        for w in terms: posted.update(self.weights[w][0])
+        rest = sorted(
+            [i for i in candidates if i not in posted and i in self.pages],
+            key=lambda i: self.normalized_pagerank(i), reverse=True
+        )
+        for webpage_id in rest:
+            if pagerank_weight * self.normalized_pagerank(webpage_id) <= threshold(): break
+            push(webpage_id)
+
+        return [a[2] for a in sorted(heap, reverse=True)]
+
+index_engine: InvertedIndex | None = None
+index_lock = threading.Lock()
+
+@on_index_change
+def reset_index():
+    global index_engine
+    index_engine = None
+
+def get_index() -> InvertedIndex:
+    global index_engine
+    if index_engine is None:
+        with index_lock:
+            if index_engine is None: load_index()
+    return index_engine
+
+def load_index() -> InvertedIndex:
+    global index_engine
+    with Session() as db:
+        # swap in the new index only after it is completely loaded
+        index_engine = InvertedIndex().load(db=db)
+    return index_engine
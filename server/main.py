@@ -1,64 +1,100 @@
 from pydantic import BaseModel, Field
-from typing import Any
+from typing import Any, Iterable, Iterator
 from fastapi import FastAPI
-from search import search, joined_search, suggest_query, Session
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from search import search, joined_search, stream_search, suggest_query, Session
+import json
+from autocomplete import get_autocomplete_index, max_autocomplete_words
+from cache import check_index_generation, result_cache
+from feedback import get_feedback_store
 
 app = FastAPI()
 
 class SearchParams(BaseModel):
     query: dict[str, Any] = dict()
     cookies: list[dict[str, Any]] = list()
+    session_id: str | None = None # feedback kept by the server is used instead of cookies
+    k: int | None = Field(default=None, ge=1) # page size
+    offset: int = Field(default=0, ge=0)
+    stream: bool = False # ndjson lines: query vectors, then one webpage per line
 @app.post("/search")
 def search_query(parmas: SearchParams):
-    with Session() as db:
-        webpages, original_query_vector, modified_query_vector = search(
-            query=parmas.query.get('query', ''),
-            cookies=parmas.cookies,
-            title_any=parmas.query.get('title_any', list()),
-            title_all=parmas.query.get('title_all', list()),
-            title_not=parmas.query.get('title_not', list()),
-            body_any=parmas.query.get('body_any', list()),
-            body_all=parmas.query.get('body_all', list()),
-            body_not=parmas.query.get('body_not', list()),
-            page_any=parmas.query.get('page_any', list()),
-            page_all=parmas.query.get('page_all', list()),
-            page_not=parmas.query.get('page_not', list()),
-            from_date=parmas.query.get('from_date', None),
-            to_date=parmas.query.get('to_date', None)
-        )
+    query = dict(
+        query=parmas.query.get('query', ''),
+        cookies=parmas.cookies,
+        session_id=parmas.session_id,
+        title_any=parmas.query.get('title_any', list()),
+        title_all=parmas.query.get('title_all', list()),
+        title_not=parmas.query.get('title_not', list()),
+        body_any=parmas.query.get('body_any', list()),
+        body_all=parmas.query.get('body_all', list()),
+        body_not=parmas.query.get('body_not', list()),
+        page_any=parmas.query.get('page_any', list()),
+        page_all=parmas.query.get('page_all', list()),
+        page_not=parmas.query.get('page_not', list()),
+        from_date=parmas.query.get('from_date', None),
+        to_date=parmas.query.get('to_date', None),
+        k=parmas.k,
+        offset=parmas.offset,
+    )
+    if parmas.stream:
+        check_index_generation()
+        return StreamingResponse(to_ndjson(stream_search(**query)), media_type='application/x-ndjson')
 
-        return {
-            'webpages': webpages,
-            'original_query_vector': original_query_vector,
-            'modified_query_vector': modified_query_vector,
-        }
+    webpages, original_query_vector, modified_query_vector = search(**query)
+    return {
+        'webpages': webpages,
+        'original_query_vector': original_query_vector,
+        'modified_query_vector': modified_query_vector,
+        'offset': parmas.offset,
+        'next_offset': get_next_offset(webpages, parmas.k, parmas.offset),
+    }
 
 class JoinedSearchParams(BaseModel):
     queries: dict[str, Any]
     cookies: list[dict[str, Any]] = list()
+    session_id: str | None = None # feedback kept by the server is used instead of cookies
+    k: int | None = Field(default=None, ge=1) # page size
+    offset: int = Field(default=0, ge=0)
 @app.post("/joined_search")
 def joined_search_query(params: JoinedSearchParams):
-    with Session() as db:
-        webpages, original_query_vector, modified_query_vector = joined_search(
-            queries=params.queries,
-            cookies=params.cookies,
-        )
+    # not streamed, subqueries are merged once all their results are scored
+    webpages, original_query_vector, modified_query_vector = joined_search(
+        queries=params.queries,
+        cookies=params.cookies,
+        session_id=params.session_id,
+        k=params.k,
+        offset=params.offset,
+    )
+    return {
+        'webpages': webpages,
+        'original_query_vector': original_query_vector,
+        'modified_query_vector': modified_query_vector,
+        'offset': params.offset,
+        'next_offset': get_next_offset(webpages, params.k, params.offset),
+    }
 
-        return {
-            'webpages': webpages,
-            'original_query_vector': original_query_vector,
-            'modified_query_vector': modified_query_vector,
-        }
+def get_next_offset(webpages: list[Any], k: int | None, offset: int) -> int | None:
+    # None if there is no more page
+    if k is None or len(webpages) < k: return None
+    return offset + len(webpages)
+
+def to_ndjson(lines: Iterable[dict[str, Any]]) -> Iterator[str]:
+    for line in lines: yield json.dumps(jsonable_encoder(line)) + '\n'
 
 class SuggestQueryParams(BaseModel):
     query: str
     cookies: list[dict[str, Any]] = list()
+    session_id: str | None = None
 @app.post("/suggest_query")
 def suggest_query_api(params: SuggestQueryParams):
+    check_index_generation()
     with Session() as db:
         fuzzy_matched_keywords, pmi_words, relevant_words, sim_queries = suggest_query(
             query=params.query,
             cookies=params.cookies,
+            session_id=params.session_id,
             db=db
         )
 
@@ -69,3 +105,27 @@ def suggest_query_api(params: SuggestQueryParams):
             'similar_queries': sim_queries,
         }
 
+class FeedbackParams(BaseModel):
+    session_id: str
+    histories: dict[int, dict[str, Any]] # history index: same as a cookie
+@app.post("/feedback")
+def feedback_api(params: FeedbackParams):
+    get_feedback_store().put(params.session_id, params.histories)
+    return {
+        'session_id': params.session_id,
+        'version': get_feedback_store().version(params.session_id),
+    }
+
+class AutocompleteParams(BaseModel):
+    query: str
+    k: int = max_autocomplete_words
+@app.post("/autocomplete")
+def autocomplete_api(params: AutocompleteParams):
+    check_index_generation()
+    return {
+        'words': get_autocomplete_index().autocomplete(params.query, k=params.k),
+    }
+
+@app.get("/cache_stats")
+def cache_stats_api():
+    return result_cache.stats()
@@ -0,0 +1,86 @@
+from html.entities import html5
+from html.parser import HTMLParser
+from constant import html_parser_backend
+
+# tags whose strings are not text of the page, as in get_text of BeautifulSoup
+skipped_tags = ('script', 'style', 'template')
+
+class PageParser(HTMLParser):
+    # title, link hrefs and text of a page in one pass without building a tree
+    # the same as soup.title.string, soup.find_all('a', href=True) and soup.get_text() of BeautifulSoup with html.parser
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.title: str | None = None
+        self.links: list[str] = list()
+        self.texts: list[str] = list()
+        self.title_texts: list[str] | None = None # while in the first title
+        self.has_title = False
+        self.skipped_depth = 0
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]):
+        if self.title_texts is not None: self.title_texts = None # title with tags has no string
+        if tag == 'a':
+            hrefs = [v if v is not None else '' for k, v in attrs if k == 'href']
+            if len(hrefs) > 0: self.links.append(hrefs[-1])
+        elif tag in skipped_tags: self.skipped_depth += 1
+        elif tag == 'title' and not self.has_title:
+            self.has_title = True
+            self.title_texts = list()
+
+    def handle_endtag(self, tag: str):
+        if tag in skipped_tags and self.skipped_depth > 0: self.skipped_depth -= 1
+        elif tag == 'title' and self.title_texts is not None:
+            if len(self.title_texts) > 0: self.title = ''.join(self.title_texts)
+            self.title_texts = None
+
+    def handle_data(self, data: str):
+        if self.skipped_depth > 0: return
+        self.texts.append(data)
+        if self.title_texts is not None: self.title_texts.append(data)
+
+    def handle_entityref(self, name: str):
+        # unknown entities are kept as text
+        self.handle_data(html5.get(f'{name};', f'&{name}'))
+
+    def handle_charref(self, name: str):
+        code = int(name[1:], 16) if name[:1] in ('x', 'X') else int(name)
+        data = None
+        # numeric references below 256 are often meant as windows-1252
+        if code < 256:
+            try: data = bytes([code]).decode('windows-1252')
+            except UnicodeDecodeError: pass
+        if not data:
+            try: data = chr(code)
+            except (ValueError, OverflowError): pass
+        self.handle_data(data or '\N{REPLACEMENT CHARACTER}')
+
+    def unknown_decl(self, data: str):
+        if data.upper().startswith('CDATA['): self.handle_data(data[len('CDATA['):])
+
+def parse_with_lxml(page: str) -> tuple[str | None, list[str], str]:
+    import lxml.html
+    from lxml import etree
+    tree = lxml.html.fromstring(page.encode('utf-8'), parser=lxml.html.HTMLParser(encoding='utf-8'))
+    title = next(tree.iter('title'), None)
+    links = [a.get('href') for a in tree.iter('a') if a.get('href') is not None]
+    etree.strip_elements(tree, *skipped_tags, with_tail=False)
+    return title.text if title is not None and len(title) <= 0 else None, links, tree.text_content()
+
+def parse_with_selectolax(page: str) -> tuple[str | None, list[str], str]:
+    from selectolax.lexbor import LexborHTMLParser
+    tree = LexborHTMLParser(page)
+    title = tree.css_first('title')
+    links = [a.attributes.get('href') or '' for a in tree.css('a[href]')]
+    tree.strip_tags(list(skipped_tags))
+    return title.text() if title is not None else None, links, tree.root.text(separator='') if tree.root is not None else ''
+
+def parse_html(page: str, backend: str = html_parser_backend) -> tuple[str | None, list[str], str]:
+    # title, link hrefs and text of a page
+    # lxml and selectolax are optional and may differ from html.parser in whitespace and broken markup
+    if backend == 'lxml': return parse_with_lxml(page)
+    if backend == 'selectolax': return parse_with_selectolax(page)
+    parser = PageParser()
+    parser.feed(page)
+    parser.close()
+    if parser.title_texts is not None and len(parser.title_texts) > 0: parser.title = ''.join(parser.title_texts) # title not closed
+    return parser.title, parser.links, ''.join(parser.texts)
@@ -0,0 +1,61 @@
+from array import array
+from db.schemas import *
+from db.database import *
+from cache import on_index_change
+import threading
+
+class PMIGraph:
+    def __init__(self):
+        # word_id: (co-occuring word ids, pmi / max pmi * co_occurence_weight) in table order
+        # compute_pmi only keeps the top co-occuring words of each word
+        self.word1: dict[int, tuple[array, array]] = dict() # word as word1_id
+        self.word2: dict[int, tuple[array, array]] = dict() # word as word2_id
+        self.max_pmi: float | None = None
+
+    def load(self, db = Session()):
+        self.max_pmi = db.query(func.max(PMI.pmi)).scalar()
+        if self.max_pmi is None: return self
+
+        for word1_id, word2_id, pmi in db.query(PMI.word1_id, PMI.word2_id, PMI.pmi).all():
+            weight = pmi / self.max_pmi * co_occurence_weight
+            for neighbors, word_id, neighbor_id in ((self.word1, word1_id, word2_id), (self.word2, word2_id, word1_id)):
+                if word_id not in neighbors: neighbors[word_id] = (array('i'), array('d'))
+                neighbors[word_id][0].append(neighbor_id)
+                neighbors[word_id][1].append(weight)
+        return self
+
+    def expand(self, query_tfs: dict[int, float]) -> dict[int, float]: # word_id: pmi weighted tf
+        # same order as the pmi rows of compute_co_occurence_tfidf, the last row of a word is kept
+        pmi_word_tfs: dict[int, float] = dict()
+        word_ids = sorted(query_tfs.keys())
+        for word_id in word_ids:
+            neighbor_ids, weights = self.word1.get(word_id, (list(), list()))
+            for neighbor_id, weight in zip(neighbor_ids, weights):
+                if neighbor_id not in query_tfs: pmi_word_tfs[neighbor_id] = weight * query_tfs[word_id]
+        for word_id in word_ids:
+            neighbor_ids, weights = self.word2.get(word_id, (list(), list()))
+            for neighbor_id, weight in zip(neighbor_ids, weights):
+                if neighbor_id not in query_tfs: pmi_word_tfs[neighbor_id] = weight * query_tfs[word_id]
+        return pmi_word_tfs
+
+pmi_graph: PMIGraph | None = None
+pmi_lock = threading.Lock()
+
+@on_index_change
+def reset_pmi_graph():
+    global pmi_graph
+    pmi_graph = None
+
+def get_pmi_graph() -> PMIGraph:
+    global pmi_graph
+    if pmi_graph is None:
+        with pmi_lock:
+            if pmi_graph is None: load_pmi_graph()
+    return pmi_graph
+
+def load_pmi_graph() -> PMIGraph:
+    global pmi_graph
+    with Session() as db:
+        # swapped in only after it is completely loaded
+        pmi_graph = PMIGraph().load(db=db)
+    return pmi_graph
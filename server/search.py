@@ -2,10 +2,19 @@ from sqlalchemy import Subquery
 from db.schemas import *
 from db.database import *
 from sqlalchemy.orm import aliased
-from utils import extract_keywords
+from utils import analyze_query
 from math import log2, sqrt
 from utils import *
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Future, ThreadPoolExecutor
+from index import get_index
+from sparse_index import get_sparse_index
+from bitmap import get_bitmap_index
+from fuzzy import get_fuzzy_index
+from pmi import get_pmi_graph
+from feedback import get_feedback_store
+from cache import cached
+from typing import Iterator
+import heapq
 import time
 
 '''
@@ -27,7 +36,7 @@ import time
 
 terms_ids: dict[int ,str] = dict()
 
-def search(
+def select_webpages(
     query: str = '',
     title_any: list[tuple[str, int]] = list(),
     title_all: list[tuple[str, int]] = list(),
@@ -40,12 +49,15 @@ def search(
     page_not: list[tuple[str, int]] = list(),
     from_date: str | None = None,
     to_date: str | None = None,
-    cookies: list[dict[str, Any]] = list()
+    cookies: list[dict[str, Any]] = list(),
+    session_id: str | None = None,
 ) -> tuple[
-    list[tuple[dict[str, Any], float]], # webpage: score
+    dict[int, float], # original query tfidf
+    dict[int, float], # modified query tfidf
     dict[str, tuple[int, float]], # word: (word_id, tfidf) (original query)
     dict[str, tuple[int, float]], # word: (word_id, tfidf) (modified query)
-]:
+    list[int], # candidate webpage ids
+] | None:
     global terms_ids
 
     title_all = set([a[1] for a in title_all])
@@ -68,9 +80,13 @@ def search(
     )
 
     page_all.update(must_inc)
+    phrase_ids = None
+    if use_positional_index:
+        phrase_ids = query_phrase_webpage_id(extract_phrase_terms(query), db=db)
 
     if len(query_tfidfs) <= 0 or len(query_tfs) <= 0:
-        return dict(), dict(), dict()
+        db.close()
+        return None
     word_ids: set[int] = {k for k, v in query_tfidfs.items() if v >= 0}
     pmi_tfidfs = compute_co_occurence_tfidf(query_tfs, require_idf=True, db=db)
 
@@ -78,7 +94,7 @@ def search(
     modified_query_tfidfs: dict[int, float] = dict()
     # relevance feedback consideration
     modified_query_tfidfs, _ = compute_relevance_feedback(
-        qtfidf=query_tfidfs.copy(), cookies=cookies
+        qtfidf=query_tfidfs.copy(), cookies=cookies, session_id=session_id
     )
 
     # pmi consideration
@@ -97,120 +113,343 @@ def search(
     original_query_vector = {terms_ids[i]: (i, j) for i, j in query_tfidfs.items()}
     modified_query_vector = {terms_ids[i]: (i, j) for i, j in modified_query_tfidfs.items()}
 
-    in_clause, notin_clause = query_webpage_id(
-        db=db,
-        title_all=title_all, title_any=title_any, title_not=title_not,
-        body_all=body_all, body_any=body_any, body_not=body_not,
-        page_all=page_all, page_any=page_any.union(word_ids), page_not=page_not,
-    )
+    if use_bitmap_filter:
+        db.close()
+        wepage_ids = get_bitmap_index().query_webpage_id(
+            title_all=title_all, title_any=title_any, title_not=title_not,
+            body_all=body_all, body_any=body_any, body_not=body_not,
+            page_all=page_all, page_any=page_any.union(word_ids), page_not=page_not,
+            from_date=from_date, to_date=to_date,
+        )
+    else:
+        in_clause, notin_clause = query_webpage_id(
+            db=db,
+            title_all=title_all, title_any=title_any, title_not=title_not,
+            body_all=body_all, body_any=body_any, body_not=body_not,
+            page_all=page_all, page_any=page_any.union(word_ids), page_not=page_not,
+        )
+
+        where_clause = [Webpage.is_active == True, Webpage.is_crawled == True]
+
+        if len(in_clause) > 0:
+            where_clause += [Webpage.webpage_id.in_(a) for a in in_clause]
+        if len(notin_clause) > 0:
+            where_clause += [Webpage.webpage_id.notin_(a) for a in notin_clause]
+        if from_date is not None:
+            where_clause.append(Webpage.last_modified_date >= from_date)
+        if to_date is not None:
+            where_clause.append(Webpage.last_modified_date <= to_date)
 
-    where_clause = [Webpage.is_active == True, Webpage.is_crawled == True]
+        wepage_ids = [a[0] for a in db.query(Webpage.webpage_id).filter(and_(*where_clause)).all()]
+        db.close()
 
-    if len(in_clause) > 0:
-        where_clause += [Webpage.webpage_id.in_(a) for a in in_clause]
-    if len(notin_clause) > 0:
-        where_clause += [Webpage.webpage_id.notin_(a) for a in notin_clause]
-    if from_date is not None:
-        where_clause.append(Webpage.last_modified_date >= from_date)
-    if to_date is not None:
-        where_clause.append(Webpage.last_modified_date <= to_date)
+    if phrase_ids is not None:
+        wepage_ids = [a for a in wepage_ids if a in phrase_ids]
 
-    wepage_ids = db.query(Webpage.webpage_id).filter(and_(*where_clause))
-    db.close()
+    return query_tfidfs, modified_query_tfidfs, original_query_vector, modified_query_vector, wepage_ids
+
+@cached
+def search(
+    query: str = '',
+    title_any: list[tuple[str, int]] = list(),
+    title_all: list[tuple[str, int]] = list(),
+    title_not: list[tuple[str, int]] = list(),
+    body_any: list[tuple[str, int]] = list(),
+    body_all: list[tuple[str, int]] = list(),
+    body_not: list[tuple[str, int]] = list(),
+    page_any: list[tuple[str, int]] = list(),
+    page_all: list[tuple[str, int]] = list(),
+    page_not: list[tuple[str, int]] = list(),
+    from_date: str | None = None,
+    to_date: str | None = None,
+    cookies: list[dict[str, Any]] = list(),
+    session_id: str | None = None,
+    k: int | None = None, # only return top k webpages if given
+    offset: int = 0, # skip the first offset webpages
+) -> tuple[
+    list[tuple[dict[str, Any], float]], # webpage: score
+    dict[str, tuple[int, float]], # word: (word_id, tfidf) (original query)
+    dict[str, tuple[int, float]], # word: (word_id, tfidf) (modified query)
+]:
+    selected = select_webpages(
+        query=query,
+        title_any=title_any, title_all=title_all, title_not=title_not,
+        body_any=body_any, body_all=body_all, body_not=body_not,
+        page_any=page_any, page_all=page_all, page_not=page_not,
+        from_date=from_date, to_date=to_date, cookies=cookies, session_id=session_id,
+    )
+    if selected is None: return dict(), dict(), dict()
+    query_tfidfs, modified_query_tfidfs, original_query_vector, modified_query_vector, wepage_ids = selected
 
     output = []
-    with ThreadPoolExecutor(max_workers=max_thread_worker) as executor:
-        futures = [executor.submit(get_webpage_info, query_tfidfs, modified_query_tfidfs, a[0]) for a in wepage_ids]
-        for f in futures:
-            result = f.result()
+    n = offset + k if k is not None else None
+    if scoring_backend == 'index' and k is not None:
+        # top-k pruning does not need to score every candidate
+        output = get_index().top_k(
+            modified_query_tfidfs, set(wepage_ids), n, 
+            evaluate=lambda i: get_indexed_webpage_info(query_tfidfs, modified_query_tfidfs, i)
+        )[offset:]
+    elif scoring_backend == 'sparse' or n is not None or offset > 0:
+        # pages are scored first, only the requested pages are loaded from the database
+        scores = score_webpages(query_tfidfs, modified_query_tfidfs, wepage_ids)
+        scored_ids = rank_webpages(wepage_ids, scores, n) if n is not None or offset > 0 else [a for a in wepage_ids if a in scores]
+        output = hydrate_webpages(query_tfidfs, modified_query_tfidfs, scored_ids[offset:], scores)
+    elif scoring_backend == 'batch':
+        output = get_webpage_infos(query_tfidfs, modified_query_tfidfs, wepage_ids)
+    elif scoring_backend == 'index':
+        for a in wepage_ids:
+            result = get_indexed_webpage_info(query_tfidfs, modified_query_tfidfs, a)
             if result == None: continue
             output.append(result)
+    else:
+        with ThreadPoolExecutor(max_workers=max_thread_worker) as executor:
+            futures = [executor.submit(get_webpage_info, query_tfidfs, modified_query_tfidfs, a) for a in wepage_ids]
+            for f in futures:
+                result = f.result()
+                if result == None: continue
+                output.append(result)
 
     # sort by similarity
     return (
-        sorted(output, key=lambda kv: kv[1], reverse=True), 
+        sort_result(output, k=k), 
         original_query_vector, 
         modified_query_vector
     )
 
+def stream_search(
+    query: str = '',
+    title_any: list[tuple[str, int]] = list(),
+    title_all: list[tuple[str, int]] = list(),
+    title_not: list[tuple[str, int]] = list(),
+    body_any: list[tuple[str, int]] = list(),
+    body_all: list[tuple[str, int]] = list(),
+    body_not: list[tuple[str, int]] = list(),
+    page_any: list[tuple[str, int]] = list(),
+    page_all: list[tuple[str, int]] = list(),
+    page_not: list[tuple[str, int]] = list(),
+    from_date: str | None = None,
+    to_date: str | None = None,
+    cookies: list[dict[str, Any]] = list(),
+    session_id: str | None = None,
+    k: int | None = None,
+    offset: int = 0,
+) -> Iterator[dict[str, Any]]:
+    # query vectors first, then the webpages in rank order, loaded from the database chunk by chunk
+    selected = select_webpages(
+        query=query,
+        title_any=title_any, title_all=title_all, title_not=title_not,
+        body_any=body_any, body_all=body_all, body_not=body_not,
+        page_any=page_any, page_all=page_all, page_not=page_not,
+        from_date=from_date, to_date=to_date, cookies=cookies, session_id=session_id,
+    )
+    if selected is None: 
+        yield {'original_query_vector': dict(), 'modified_query_vector': dict()}
+        return
+    query_tfidfs, modified_query_tfidfs, original_query_vector, modified_query_vector, wepage_ids = selected
+    yield {'original_query_vector': original_query_vector, 'modified_query_vector': modified_query_vector}
+
+    scores = score_webpages(query_tfidfs, modified_query_tfidfs, wepage_ids)
+    scored_ids = rank_webpages(wepage_ids, scores, offset + k if k is not None else None)[offset:]
+    for i in range(0, len(scored_ids), stream_chunk_size):
+        chunk = hydrate_webpages(query_tfidfs, modified_query_tfidfs, scored_ids[i: i + stream_chunk_size], scores)
+        for webpage, score in sort_result(chunk):
+            yield {'webpage': webpage, 'score': score}
+
+def score_webpages(
+    original_query_tfidf: dict[int, float], 
+    modified_query_tfidfs: dict[int, float], 
+    webpage_ids: list[int],
+) -> dict[int, tuple[float, float]]: # webpage_id: (original score, modified score)
+    if scoring_backend == 'sparse':
+        index = get_sparse_index()
+        scores = index.score(original_query_tfidf, modified_query_tfidfs, webpage_ids)
+        # pages crawled after the matrix was built
+        missing = [a for a in webpage_ids if a not in index.rows]
+        if len(missing) > 0: scores.update(get_webpage_scores(original_query_tfidf, modified_query_tfidfs, missing))
+        return scores
+    if scoring_backend == 'index':
+        results = [get_indexed_webpage_info(original_query_tfidf, modified_query_tfidfs, a) for a in webpage_ids]
+        return {a[0]['webpage_id']: (a[0]['original_score'], a[0]['modified_score']) for a in results if a is not None}
+    return get_webpage_scores(original_query_tfidf, modified_query_tfidfs, webpage_ids)
+
+def rank_webpages(
+    webpage_ids: list[int], 
+    scores: dict[int, tuple[float, float]], 
+    k: int | None = None
+) -> list[int]:
+    # by modified score, ties kept in candidate order
+    webpage_ids = [a for a in webpage_ids if a in scores]
+    if k is None: return sorted(webpage_ids, key=lambda i: scores[i][1], reverse=True)
+    return heapq.nlargest(k, webpage_ids, key=lambda i: scores[i][1])
+
+def hydrate_webpages(
+    original_query_tfidf: dict[int, float], 
+    modified_query_tfidfs: dict[int, float], 
+    webpage_ids: list[int],
+    scores: dict[int, tuple[float, float]],
+) -> list[tuple[dict[str, Any], float]]:
+    if scoring_backend == 'index':
+        output = []
+        for a in webpage_ids:
+            result = get_indexed_webpage_info(original_query_tfidf, modified_query_tfidfs, a)
+            if result is None: continue
+            result[0]['original_score'], result[0]['modified_score'] = scores[a]
+            output.append((result[0], scores[a][1]))
+        return output
+    return get_webpage_infos(original_query_tfidf, modified_query_tfidfs, webpage_ids, scores=scores)
+
+def sort_result(
+    output: list[tuple[dict[str, Any], float]], 
+    k: int | None = None
+) -> list[tuple[dict[str, Any], float]]:
+    if k is None: return sorted(output, key=lambda kv: kv[1], reverse=True)
+    return heapq.nlargest(k, output, key=lambda kv: kv[1])
+
+class QueryNode:
+    def __init__(self, queries: dict[str, Any] | None):
+        # single query if there is no sub-queries, otherwise pages are joined by type
+        self.queries = queries if isinstance(queries, dict) else dict()
+        self.is_merged = self.queries.get('type', None) == 'merged'
+        self.children: list[QueryNode] = [QueryNode(i) for i in self.queries.get('queries', list())]
+        self.selected: Future | None = None # result of select_webpages
+        self.skipped = False
+        self.candidates: set[int] = set()
+        self.scores: dict[int, tuple[float, float]] = dict()
+
+    def is_leaf(self) -> bool:
+        return 'queries' not in self.queries
+
+    def leaves(self) -> list['QueryNode']:
+        if self.is_leaf(): return [self]
+        return [a for i in self.children for a in i.leaves()]
+
+    def resolve(self) -> set[int]:
+        # candidate webpage ids, before scoring
+        if self.is_leaf():
+            selected = self.selected.result() if self.selected is not None else None
+            self.candidates = set(selected[4]) if selected is not None else set()
+        elif self.is_merged:
+            self.candidates = set().union(*[i.resolve() for i in self.children])
+        else:
+            self.candidates = None
+            for i, child in enumerate(self.children):
+                candidates = child.resolve()
+                self.candidates = candidates if self.candidates is None else self.candidates.intersection(candidates)
+                if len(self.candidates) <= 0:
+                    # the other queries are not needed anymore
+                    for a in self.children[i + 1:]:
+                        for leaf in a.leaves():
+                            leaf.skipped = True
+                            if leaf.selected is not None: leaf.selected.cancel()
+                    break
+            if self.candidates is None: self.candidates = set()
+        return self.candidates
+
+    def restrict(self, webpage_ids: set[int]):
+        # only pages surviving every join above are scored
+        self.candidates = self.candidates.intersection(webpage_ids)
+        for i in self.children: i.restrict(self.candidates)
+
+    def combine(self) -> tuple[
+        dict[int, tuple[float, float]], 
+        dict[str, tuple[int, float]], 
+        dict[str, tuple[int, float]],
+    ]:
+        # scores and query vectors averaged across the queries
+        if self.is_leaf():
+            selected = self.selected.result() if self.selected is not None and not self.skipped else None
+            if selected is None: return dict(), dict(), dict()
+            return self.scores, selected[2], selected[3]
+
+        n = len(self.children)
+        scores: dict[int, tuple[float, float]] = dict()
+        original_query_vector: dict[str, tuple[int, float]] = dict()
+        modified_query_vector: dict[str, tuple[int, float]] = dict()
+        counts: dict[int, int] = dict()
+        for child in self.children:
+            child_scores, q_vector, mq_vector = child.combine()
+            for webpage_id, (original_score, modified_score) in child_scores.items():
+                a = scores.get(webpage_id, (0, 0))
+                scores[webpage_id] = (a[0] + original_score / n, a[1] + modified_score / n)
+                counts[webpage_id] = counts.get(webpage_id, 0) + 1
+
+            original_query_vector = merge_dict(
+                a=original_query_vector, b=q_vector,
+                func=lambda a, b: (
+                    (a[0] if a is not None else b[0]),
+                    (a[1] if a is not None else 0) + (b[1] if b is not None else 0) / n
+                )
+            )
+            modified_query_vector = merge_dict(
+                a=modified_query_vector, b=mq_vector,
+                func=lambda a, b: (
+                    (a[0] if a is not None else b[0]),
+                    (a[1] if a is not None else 0) + (b[1] if b is not None else 0) / n
+                )
+            )
+
+        if not self.is_merged:
+            scores = {i: j for i, j in scores.items() if counts[i] == n}
+        return scores, original_query_vector, modified_query_vector
+
+@cached
 def joined_search(
     queries: dict[str, Any], 
-    cookies: list[dict[str, Any]] = list()
+    cookies: list[dict[str, Any]] = list(),
+    session_id: str | None = None,
+    k: int | None = None, # only return top k webpages if given
+    offset: int = 0, # skip the first offset webpages
 ) -> tuple[
     list[tuple[dict[str, Any], float]], 
     dict[str, tuple[int, float]],
     dict[str, tuple[int, float]],
 ]:
-    average_result: dict[int, tuple[dict[str, Any], float]] = dict()
-    original_query_vector: dict[str, tuple[int, float]] = dict()
-    modified_query_vector: dict[str, tuple[int, float]] = dict()
-
-    # list of queries
-    n = len(queries['queries'])
-    for i in queries['queries']:
-        result, q_vector = [], dict()
-        if isinstance(i, dict):
-            if 'queries' in i.keys():
-                result, q_vector, mq_vector = joined_search(i, cookies=cookies)
-            else:
-                result, q_vector, mq_vector = search(
-                    query=i.get('query', ''), 
-                    title_any=i.get('title_any', list()),
-                    title_all=i.get('title_all', list()),
-                    title_not=i.get('title_not', list()),
-                    body_any=i.get('body_any', list()),
-                    body_all=i.get('body_all', list()),
-                    body_not=i.get('body_not', list()),
-                    from_date=i.get('from_date', None),
-                    to_date=i.get('to_date', None),
-                    cookies=cookies
-                )
-
-        if len(average_result) == 0:
-            average_result = {j[0]['webpage_id']: (j[0], j[1] / n) for j in result}
-        else:
-            for j in result:
-                # union
-                if j[0]['webpage_id'] not in average_result.keys():
-                    if queries['type'] == 'merged':
-                        average_result[j[0]['webpage_id']] = (j[0], j[1] / n)
-                # intersect
-                else:
-                    average_result[j[0]['webpage_id']] = (
-                        j[0], average_result[j[0]['webpage_id']][1] + j[1] / n
-                    )
-
-        original_query_vector = merge_dict(
-            a=original_query_vector, b=q_vector,
-            func=lambda a, b: (
-                (a[0] if a is not None else b[0]),
-                (a[1] if a is not None else 0) + (b[1] if b is not None else 0) / n
+    # merged queries are joined by union and subqueries by intersection
+    # candidates of all queries are joined before any page is scored
+    tree = QueryNode(queries)
+    leaves = tree.leaves()
+    with ThreadPoolExecutor(max_workers=max_thread_worker) as executor:
+        for leaf in leaves:
+            leaf.selected = executor.submit(
+                select_webpages,
+                query=leaf.queries.get('query', ''), 
+                title_any=leaf.queries.get('title_any', list()),
+                title_all=leaf.queries.get('title_all', list()),
+                title_not=leaf.queries.get('title_not', list()),
+                body_any=leaf.queries.get('body_any', list()),
+                body_all=leaf.queries.get('body_all', list()),
+                body_not=leaf.queries.get('body_not', list()),
+                page_any=leaf.queries.get('page_any', list()),
+                page_all=leaf.queries.get('page_all', list()),
+                page_not=leaf.queries.get('page_not', list()),
+                from_date=leaf.queries.get('from_date', None),
+                to_date=leaf.queries.get('to_date', None),
+                cookies=cookies,
+                session_id=session_id,
             )
-        )
-        
-        modified_query_vector = merge_dict(
-            a=modified_query_vector, b=mq_vector,
-            func=lambda a, b: (
-            (a[0] if a is not None else b[0]),
-            (a[1] if a is not None else 0) + (b[1] if b is not None else 0) / n
+        tree.restrict(tree.resolve())
+
+        # each query scores its surviving pages only
+        def score(leaf: QueryNode):
+            if len(leaf.candidates) <= 0 or leaf.skipped: return
+            query_tfidfs, modified_query_tfidfs, _, _, wepage_ids = leaf.selected.result()
+            leaf.scores = score_webpages(
+                query_tfidfs, modified_query_tfidfs, [a for a in wepage_ids if a in leaf.candidates]
             )
-        )
+        for f in [executor.submit(score, leaf) for leaf in leaves]: f.result()
 
+    scores, original_query_vector, modified_query_vector = tree.combine()
+    scored_ids = rank_webpages(sorted(scores.keys()), scores, offset + k if k is not None else None)[offset:]
     return (
-        sorted(average_result.values(), key=lambda kv: kv[1], reverse=True), 
+        sort_result(hydrate_webpages(dict(), dict(), scored_ids, scores)), 
         original_query_vector, 
         modified_query_vector
     )
 
-def combine_weight(title: dict[int, float], body: dict[int, float]) -> dict[int, float]:
-    return merge_dict(
-        a=title, b=body, 
-        func=lambda a, b: (a if a is not None else 0) * title_weight + (b if b is not None else 0) * (1 - title_weight)
-    )
-
 def suggest_query(
     query: str,
     cookies: list[dict[str, Any]] = list(),
+    session_id: str | None = None,
     db = Session()
 ) -> tuple[
     list[tuple[str, int, float]], # word: (word_id, probability)
@@ -224,7 +463,7 @@ def suggest_query(
 
     # relevance feedback consideration
     query_tfidfs, sim_queries = compute_relevance_feedback(
-        qtfidf=query_tfidfs, cookies=cookies
+        qtfidf=query_tfidfs, cookies=cookies, session_id=session_id
     )
     relevant_words = sorted(
         [(k, v) for k, v in query_tfidfs.items() if k not in word_ids and v >= 0], 
@@ -258,7 +497,9 @@ def suggest_query(
 def compute_cosine_similarity(
     q1: dict[int, float],
     q2: dict[int, float],
+    q2_norm: float | None = None,
 ) -> float:
+    # q2 may only hold the terms of q1 if its norm is given
     q1_sum = 0
     q2_sum = 0
     nominator = 0
@@ -271,16 +512,21 @@ def compute_cosine_similarity(
         q1_sum += q1_tfidf ** 2
         nominator += q1_tfidf * q2_tfidf
 
-    for word_id in q2.keys():
-        q2_sum += q2[word_id] ** 2
+    if q2_norm is None:
+        for word_id in q2.keys():
+            q2_sum += q2[word_id] ** 2
+        q2_norm = sqrt(q2_sum)
 
-    return nominator / (sqrt(q1_sum) * sqrt(q2_sum)) if (q1_sum != 0 and q2_sum != 0) else 0
+    return nominator / (sqrt(q1_sum) * q2_norm) if (q1_sum != 0 and q2_norm != 0) else 0
 
 def compute_relevance_feedback(
     qtfidf: dict[int, float], 
     cookies: list[dict[str, Any]] = list(),
+    session_id: str | None = None,
 ) -> tuple[dict[int, float], dict[str, float]]:
     # compute relevance feedback
+    if session_id is not None and len(cookies) <= 0:
+        return compute_session_feedback(qtfidf, session_id)
     print(f'cookies: {cookies}')
 
     relevant_words: list[tuple[int, float]] = list()
@@ -328,6 +574,32 @@ def compute_relevance_feedback(
 
     print(f'top queries: {top_queries}')
     return qtfidf, top_queries
+
+def compute_session_feedback(
+    qtfidf: dict[int, float], 
+    session_id: str,
+) -> tuple[dict[int, float], dict[str, float]]:
+    # same as compute_relevance_feedback, with the histories kept by the server
+    relevant_words: list[tuple[dict[int, float], float]] = list() # term weights, similarity
+    top_queries = dict()
+    relevant_n = 0
+    non_relevant_n = 0
+
+    for similarity, entries in get_feedback_store().nearest(session_id, qtfidf):
+        for entry in entries:
+            if entry.query is not None: top_queries[entry.query] = similarity
+            relevant_n += entry.relevant_n * similarity
+            non_relevant_n += entry.non_relevant_n * similarity
+            relevant_words += [(entry.relevant_terms, similarity), (entry.non_relevant_terms, similarity)]
+
+    for terms, similarity in relevant_words:
+        for word_id, freq in terms.items():
+            w = freq * similarity
+            if w < 0: w *= non_relevant_weight / non_relevant_n
+            else: w *= relevant_weight / relevant_n
+            qtfidf[word_id] = qtfidf.get(word_id, 0) + w
+
+    return qtfidf, top_queries
     
 def query_webpage_id(
     title_any: set[int] = set(),
@@ -382,7 +654,7 @@ def query_webpage_id(
             db.query(Webpage.webpage_id.distinct()).join(
                 TitleIndex, TitleIndex.webpage_id == Webpage.webpage_id
             ).filter(and_(
-                TitleIndex.word_id.notin_(title_not),
+                TitleIndex.word_id.in_(title_not),
                 TitleIndex.frequency >= 1,
                 Webpage.is_crawled == True,
                 Webpage.is_active == True,
@@ -420,7 +692,7 @@ def query_webpage_id(
             db.query(Webpage.webpage_id.distinct()).join(
                 BodyIndex, BodyIndex.webpage_id == Webpage.webpage_id
             ).filter(and_(
-                BodyIndex.word_id.notin_(body_not),
+                BodyIndex.word_id.in_(body_not),
                 BodyIndex.frequency >= 1,
                 Webpage.is_crawled == True,
                 Webpage.is_active == True,
@@ -469,12 +741,57 @@ def query_webpage_id(
             select(
                 Page.c.get('webpage_id').distinct()
             ).filter(
-                Page.c.get('word_id').notin_(page_not)
+                Page.c.get('word_id').in_(page_not)
             ).subquery()
         )
 
     return in_clause, notin_clause
 
+def match_phrase(positions: dict[int, list[int]], terms: list[tuple[int, int]]) -> bool:
+    # phrase starts where every word is found at its offset
+    starts: set[int] | None = None
+    for offset, word_id in terms:
+        found = {p - offset for p in positions.get(word_id, list())}
+        starts = found if starts is None else starts.intersection(found)
+        if len(starts) <= 0: return False
+    return True
+
+def query_phrase_webpage_id(
+    phrases: list[list[tuple[int, str]]], 
+    db=Session()
+) -> set[int] | None:
+    # webpages containing every phrase in the title or body, None if there is no phrase
+    if len(phrases) <= 0: return None
+    words = {a[1] for phrase in phrases for a in phrase}
+    word_ids = {i[1]: i[0] for i in db.query(Keyword.word_id, Keyword.word).filter(Keyword.word.in_(words)).all()}
+
+    result: set[int] | None = None
+    for phrase in phrases:
+        if any(a[1] not in word_ids for a in phrase): return set()
+        terms = [(offset, word_ids[word]) for offset, word in phrase]
+        matched: set[int] = set()
+
+        for cls in (TitleIndex, BodyIndex):
+            postings: dict[int, dict[int, list[int]]] = dict() # webpage_id: word_id: positions
+            for webpage_id, word_id, positions in db.query(
+                cls.webpage_id, cls.word_id, cls.positions
+            ).filter(and_(
+                cls.word_id.in_({a[1] for a in terms}),
+                cls.frequency >= 1,
+                cls.positions != None,
+            )).all():
+                postings.setdefault(webpage_id, dict())[word_id] = decode_positions(positions)
+
+            word_count = len({a[1] for a in terms})
+            matched.update(
+                webpage_id for webpage_id, positions in postings.items() 
+                if len(positions) == word_count and match_phrase(positions, terms)
+            )
+
+        result = matched if result is None else result.intersection(matched)
+        if len(result) <= 0: break
+    return result
+
 results = []
 def get_webpage_info(
     original_query_tfidf: dict[int, float], 
@@ -482,29 +799,52 @@ def get_webpage_info(
     webpage_id: int
 ) -> tuple[dict[str, Any], float] | None:
     with Session() as db:
-        title_tf = db.query(TitleIndex.word_id, TitleIndex.normalized_tf).filter(
-            and_(TitleIndex.webpage_id == webpage_id, TitleIndex.frequency > 0)
-        ).all()
-        body_tf = db.query(BodyIndex.word_id, BodyIndex.normalized_tf).filter(
-            and_(BodyIndex.webpage_id == webpage_id, BodyIndex.frequency > 0)
-        ).all()
-        if (len(title_tf) <= 0 and len(body_tf) <= 0): return
-
-        tfs = combine_weight(
-            title={a[0]: a[1] for a in title_tf},
-            body={a[0]: a[1] for a in body_tf}
-        )
+        norm = None
+        if use_page_vectors:
+            norm = db.query(PageNorm.norm).filter(PageNorm.webpage_id == webpage_id).scalar()
+
+        if norm is not None:
+            # materialized vector: only the query terms and the top terms are needed
+            weights = db.query(
+                PageWeight.word_id, PageWeight.tf, PageWeight.tfidf, 
+                PageWeight.tf_rank, PageWeight.tfidf_rank
+            ).filter(and_(
+                PageWeight.webpage_id == webpage_id,
+                or_(
+                    PageWeight.word_id.in_(set(original_query_tfidf.keys()).union(modified_query_tfidfs.keys())),
+                    PageWeight.tf_rank != None,
+                    PageWeight.tfidf_rank != None,
+                )
+            )).all()
+            tfidfs = {a[0]: a[2] for a in weights}
+            top_tfs = [(a[0], a[1]) for a in sorted(
+                [a for a in weights if a[3] is not None], key=lambda a: a[3]
+            )]
+            top_tfidfs = [(a[0], a[2]) for a in sorted(
+                [a for a in weights if a[4] is not None], key=lambda a: a[4]
+            )]
+        else:
+            title_tf = db.query(TitleIndex.word_id, TitleIndex.normalized_tf).filter(
+                and_(TitleIndex.webpage_id == webpage_id, TitleIndex.frequency > 0)
+            ).all()
+            body_tf = db.query(BodyIndex.word_id, BodyIndex.normalized_tf).filter(
+                and_(BodyIndex.webpage_id == webpage_id, BodyIndex.frequency > 0)
+            ).all()
+            if (len(title_tf) <= 0 and len(body_tf) <= 0): return
+
+            tfs = combine_weight(
+                title={a[0]: a[1] for a in title_tf},
+                body={a[0]: a[1] for a in body_tf}
+            )
 
-        top_tfs = sorted(tfs.items(), key=lambda a: a[1], reverse=True)[:max_ranked_words]
-        title_tfidfs = compute_tfidf({a[0]: a[1] for a in title_tf}, is_title=True, db=db)
-        body_tfidfs = compute_tfidf({a[0]: a[1] for a in body_tf}, is_title=False, db=db)
-        tfidfs = combine_weight(title=title_tfidfs, body=body_tfidfs)
+            top_tfs = sorted(tfs.items(), key=lambda a: a[1], reverse=True)[:max_ranked_words]
+            title_tfidfs = compute_tfidf({a[0]: a[1] for a in title_tf}, is_title=True, db=db)
+            body_tfidfs = compute_tfidf({a[0]: a[1] for a in body_tf}, is_title=False, db=db)
+            tfidfs = combine_weight(title=title_tfidfs, body=body_tfidfs)
+            top_tfidfs = sorted(tfidfs.items(), key=lambda a: a[1], reverse=True)[:max_ranked_words]
 
         max_pagerank, min_pagerank = db.query(func.max(Webpage.pagerank), func.min(Webpage.pagerank)).first()
         webpage = db.query(Webpage).filter(Webpage.webpage_id == webpage_id).first()
-        original_score = compute_cosine_similarity(original_query_tfidf, tfidfs)
-        modified_score = compute_cosine_similarity(modified_query_tfidfs, tfidfs) * (1 - pagerank_weight) + pagerank_weight * (webpage.pagerank - min_pagerank) / (max_pagerank - min_pagerank)
-        top_tfidfs = sorted(tfidfs.items(), key=lambda a: a[1], reverse=True)[:max_ranked_words]
 
         # for i in original_query_tfidf.keys():
         #     results.append(tfidfs.get(i))
@@ -516,35 +856,269 @@ def get_webpage_info(
 
         for s, t in words: terms_ids[t] = s
 
-        page_item = {
-            'webpage_id': webpage.webpage_id,
-            'url': webpage.url,
-            'title': webpage.title,
-            'last_modified_date': webpage.last_modified_date,
-            'size': webpage.size,
-            'top_tfs': [(terms_ids[i], i, j) for i, j in top_tfs],
-            'top_tfidfs': [(terms_ids[i], i, j) for i, j in top_tfidfs],
-            'parents': [],
-            'children': [],
-            'original_score': original_score,
-            'modified_score': modified_score
-        }
-
+        children = []
         limit = 0
         for child in webpage.parent_relation:
             if limit >= relationship_limit: break
             if child.is_active and child.child.is_active and child.child.is_crawled:
-                page_item['children'].append(child.child.url)
+                children.append(child.child.url)
                 limit += 1
 
+        parents = []
         limit = 0
         for parent in webpage.child_relation:
             if limit >= relationship_limit: break
             if parent.is_active and parent.parent.is_active and parent.parent.is_crawled:
-                page_item['parents'].append(parent.parent.url)
+                parents.append(parent.parent.url)
                 limit += 1
 
-        return page_item, modified_score
+        original_score, modified_score = compute_page_score(
+            original_query_tfidf, modified_query_tfidfs, tfidfs,
+            pagerank=webpage.pagerank, max_pagerank=max_pagerank, min_pagerank=min_pagerank,
+            norm=norm,
+        )
+        return create_page_item(
+            webpage=webpage, top_tfs=top_tfs, top_tfidfs=top_tfidfs,
+            original_score=original_score, modified_score=modified_score,
+            parents=parents, children=children,
+        )
+
+def get_webpage_infos(
+    original_query_tfidf: dict[int, float], 
+    modified_query_tfidfs: dict[int, float], 
+    webpage_ids: list[int],
+    scores: dict[int, tuple[float, float]] | None = None, # webpage_id: (original score, modified score)
+) -> list[tuple[dict[str, Any], float]]:
+    # batched get_webpage_info: rows of all pages are fetched with chunked IN queries
+    query_word_ids = set(original_query_tfidf.keys()).union(modified_query_tfidfs.keys())
+    chunks = [webpage_ids[i: i + sql_chunk_size] for i in range(0, len(webpage_ids), sql_chunk_size)]
+
+    tfidfs: dict[int, dict[int, float]] = dict()
+    top_tfs: dict[int, list[tuple[int, float]]] = dict()
+    top_tfidfs: dict[int, list[tuple[int, float]]] = dict()
+    norms: dict[int, float] = dict()
+    webpages: dict[int, Webpage] = dict()
+    children: dict[int, list[str]] = dict()
+    parents: dict[int, list[str]] = dict()
+
+    with Session() as db:
+        for chunk in chunks:
+            if use_page_vectors:
+                norms.update({i[0]: i[1] for i in db.query(PageNorm.webpage_id, PageNorm.norm).filter(
+                    PageNorm.webpage_id.in_(chunk)
+                ).all()})
+
+            # materialized vectors
+            weights = db.query(
+                PageWeight.webpage_id, PageWeight.word_id, PageWeight.tf, 
+                PageWeight.tfidf, PageWeight.tf_rank, PageWeight.tfidf_rank
+            ).filter(and_(
+                PageWeight.webpage_id.in_([i for i in chunk if i in norms]),
+                or_(
+                    PageWeight.word_id.in_(query_word_ids),
+                    PageWeight.tf_rank != None,
+                    PageWeight.tfidf_rank != None,
+                )
+            )).all() if any(i in norms for i in chunk) else []
+
+            for webpage_id, word_id, tf, tfidf, tf_rank, tfidf_rank in weights:
+                tfidfs.setdefault(webpage_id, dict())[word_id] = tfidf
+                if tf_rank is not None: top_tfs.setdefault(webpage_id, list()).append((tf_rank, word_id, tf))
+                if tfidf_rank is not None: top_tfidfs.setdefault(webpage_id, list()).append((tfidf_rank, word_id, tfidf))
+
+            # pages without materialized vectors
+            unmaterialized = [i for i in chunk if i not in norms]
+            if len(unmaterialized) > 0:
+                tfs: dict[bool, dict[int, dict[int, float]]] = {True: dict(), False: dict()}
+                for is_title, cls in ((True, TitleIndex), (False, BodyIndex)):
+                    for webpage_id, word_id, normalized_tf in db.query(
+                        cls.webpage_id, cls.word_id, cls.normalized_tf
+                    ).filter(and_(cls.webpage_id.in_(unmaterialized), cls.frequency > 0)).all():
+                        tfs[is_title].setdefault(webpage_id, dict())[word_id] = normalized_tf
+
+                idfs = {
+                    is_title: compute_tfidf(
+                        {w: 1 for t in tfs[is_title].values() for w in t.keys()}, is_title=is_title, db=db
+                    ) for is_title in (True, False)
+                }
+                for webpage_id in unmaterialized:
+                    title_tf = tfs[True].get(webpage_id, dict())
+                    body_tf = tfs[False].get(webpage_id, dict())
+                    if len(title_tf) <= 0 and len(body_tf) <= 0: continue
+                    tf = combine_weight(title=title_tf, body=body_tf)
+                    tfidfs[webpage_id] = combine_weight(
+                        title={k: v * idfs[True].get(k, 0) for k, v in title_tf.items()},
+                        body={k: v * idfs[False].get(k, 0) for k, v in body_tf.items()},
+                    )
+                    top_tfs[webpage_id] = [(0, k, v) for k, v in sorted(
+                        tf.items(), key=lambda a: a[1], reverse=True
+                    )[:max_ranked_words]]
+                    top_tfidfs[webpage_id] = [(0, k, v) for k, v in sorted(
+                        tfidfs[webpage_id].items(), key=lambda a: a[1], reverse=True
+                    )[:max_ranked_words]]
+
+            webpages.update({w.webpage_id: w for w in db.query(Webpage).filter(Webpage.webpage_id.in_(chunk)).all()})
+
+            # active relationships between active and crawled pages
+            child_relations = db.query(Relationship.parent_id, Relationship.child_id).filter(and_(
+                Relationship.parent_id.in_(chunk), Relationship.is_active == True,
+            )).all()
+            parent_relations = db.query(Relationship.parent_id, Relationship.child_id).filter(and_(
+                Relationship.child_id.in_(chunk), Relationship.is_active == True,
+            )).all()
+            related_pages = {i[0]: i[1] for i in db.query(Webpage.webpage_id, Webpage.url).filter(and_(
+                Webpage.webpage_id.in_(
+                    {r[1] for r in child_relations}.union({r[0] for r in parent_relations}).union(chunk)
+                ),
+                Webpage.is_active == True,
+                Webpage.is_crawled == True,
+            )).all()}
+            for parent_id, child_id in child_relations:
+                if parent_id in related_pages and child_id in related_pages: 
+                    children.setdefault(parent_id, list()).append(related_pages[child_id])
+            for parent_id, child_id in parent_relations:
+                if parent_id in related_pages and child_id in related_pages: 
+                    parents.setdefault(child_id, list()).append(related_pages[parent_id])
+
+        max_pagerank, min_pagerank = db.query(func.max(Webpage.pagerank), func.min(Webpage.pagerank)).first()
+        words = db.query(Keyword.word, Keyword.word_id).filter(Keyword.word_id.in_(
+            {a[1] for t in top_tfs.values() for a in t}.union({a[1] for t in top_tfidfs.values() for a in t})
+        )).all()
+        for s, t in words: terms_ids[t] = s
+
+    output = []
+    for webpage_id in webpage_ids:
+        if webpage_id not in tfidfs: continue
+        webpage = webpages[webpage_id]
+        if scores is not None:
+            original_score, modified_score = scores[webpage_id]
+        else:
+            original_score, modified_score = compute_page_score(
+                original_query_tfidf, modified_query_tfidfs, tfidfs[webpage_id],
+                pagerank=webpage.pagerank, max_pagerank=max_pagerank, min_pagerank=min_pagerank,
+                norm=norms.get(webpage_id, None),
+            )
+        output.append(create_page_item(
+            webpage=webpage, 
+            top_tfs=[(a[1], a[2]) for a in sorted(top_tfs.get(webpage_id, list()), key=lambda a: a[0])],
+            top_tfidfs=[(a[1], a[2]) for a in sorted(top_tfidfs.get(webpage_id, list()), key=lambda a: a[0])],
+            original_score=original_score, modified_score=modified_score,
+            parents=parents.get(webpage_id, list()), children=children.get(webpage_id, list()),
+        ))
+    return output
+
+def get_webpage_scores(
+    original_query_tfidf: dict[int, float], 
+    modified_query_tfidfs: dict[int, float], 
+    webpage_ids: list[int],
+) -> dict[int, tuple[float, float]]: # webpage_id: (original score, modified score)
+    # scores only, with the query terms of the materialized vectors
+    query_word_ids = set(original_query_tfidf.keys()).union(modified_query_tfidfs.keys())
+    chunks = [webpage_ids[i: i + sql_chunk_size] for i in range(0, len(webpage_ids), sql_chunk_size)]
+    tfidfs: dict[int, dict[int, float]] = dict()
+    norms: dict[int, float] = dict()
+    pageranks: dict[int, float] = dict()
+
+    with Session() as db:
+        if use_page_vectors:
+            for chunk in chunks:
+                norms.update({i[0]: i[1] for i in db.query(PageNorm.webpage_id, PageNorm.norm).filter(
+                    PageNorm.webpage_id.in_(chunk)
+                ).all()})
+                for webpage_id, word_id, tfidf in db.query(
+                    PageWeight.webpage_id, PageWeight.word_id, PageWeight.tfidf
+                ).filter(and_(
+                    PageWeight.webpage_id.in_(chunk), 
+                    PageWeight.word_id.in_(query_word_ids),
+                )).all():
+                    tfidfs.setdefault(webpage_id, dict())[word_id] = tfidf
+                pageranks.update({i[0]: i[1] for i in db.query(Webpage.webpage_id, Webpage.pagerank).filter(
+                    Webpage.webpage_id.in_(chunk)
+                ).all()})
+        max_pagerank, min_pagerank = db.query(func.max(Webpage.pagerank), func.min(Webpage.pagerank)).first()
+
+    scores = {
+        webpage_id: compute_page_score(
+            original_query_tfidf, modified_query_tfidfs, tfidfs.get(webpage_id, dict()),
+            pagerank=pageranks[webpage_id], max_pagerank=max_pagerank, min_pagerank=min_pagerank,
+            norm=norms[webpage_id],
+        ) for webpage_id in webpage_ids if webpage_id in norms
+    }
+    # pages without materialized vectors are scored with their whole vector
+    unmaterialized = [a for a in webpage_ids if a not in norms]
+    if len(unmaterialized) > 0:
+        for webpage, _ in get_webpage_infos(original_query_tfidf, modified_query_tfidfs, unmaterialized):
+            scores[webpage['webpage_id']] = (webpage['original_score'], webpage['modified_score'])
+    return scores
+
+def get_indexed_webpage_info(
+    original_query_tfidf: dict[int, float], 
+    modified_query_tfidfs: dict[int, float], 
+    webpage_id: int
+) -> tuple[dict[str, Any], float] | None:
+    index = get_index()
+    title_tf = index.get_tf(webpage_id, is_title=True)
+    body_tf = index.get_tf(webpage_id, is_title=False)
+    if (len(title_tf) <= 0 and len(body_tf) <= 0): return
+
+    tfs = combine_weight(title=title_tf, body=body_tf)
+    title_tfidfs = index.compute_tfidf(title_tf, is_title=True)
+    body_tfidfs = index.compute_tfidf(body_tf, is_title=False)
+    tfidfs = combine_weight(title=title_tfidfs, body=body_tfidfs)
+    webpage = index.pages[webpage_id]
+
+    original_score, modified_score = compute_page_score(
+        original_query_tfidf, modified_query_tfidfs, tfidfs,
+        pagerank=webpage.pagerank, max_pagerank=index.max_pagerank, min_pagerank=index.min_pagerank,
+    )
+    return create_page_item(
+        webpage=webpage,
+        top_tfs=sorted(tfs.items(), key=lambda a: a[1], reverse=True)[:max_ranked_words],
+        top_tfidfs=sorted(tfidfs.items(), key=lambda a: a[1], reverse=True)[:max_ranked_words],
+        original_score=original_score, modified_score=modified_score,
+        parents=index.parents.get(webpage_id, list()),
+        children=index.children.get(webpage_id, list()),
+        words=index.words,
+    )
+
+def compute_page_score(
+    original_query_tfidf: dict[int, float], 
+    modified_query_tfidfs: dict[int, float], 
+    tfidfs: dict[int, float],
+    pagerank: float,
+    max_pagerank: float,
+    min_pagerank: float,
+    norm: float | None = None,
+) -> tuple[float, float]:
+    original_score = compute_cosine_similarity(original_query_tfidf, tfidfs, q2_norm=norm)
+    modified_score = compute_cosine_similarity(modified_query_tfidfs, tfidfs, q2_norm=norm) * (1 - pagerank_weight) + pagerank_weight * (pagerank - min_pagerank) / (max_pagerank - min_pagerank)
+    return original_score, modified_score
+
+def create_page_item(
+    webpage: Webpage,
+    top_tfs: list[tuple[int, float]],
+    top_tfidfs: list[tuple[int, float]],
+    original_score: float,
+    modified_score: float,
+    parents: list[str],
+    children: list[str],
+    words: dict[int, str] = terms_ids,
+) -> tuple[dict[str, Any], float]:
+    page_item = {
+        'webpage_id': webpage.webpage_id,
+        'url': webpage.url,
+        'title': webpage.title,
+        'last_modified_date': webpage.last_modified_date,
+        'size': webpage.size,
+        'top_tfs': [(words[i], i, j) for i, j in top_tfs],
+        'top_tfidfs': [(words[i], i, j) for i, j in top_tfidfs],
+        'parents': parents[:relationship_limit],
+        'children': children[:relationship_limit],
+        'original_score': original_score,
+        'modified_score': modified_score
+    }
+
+    return page_item, modified_score
 
 def compute_query_tfidf(
     query: str, 
@@ -574,23 +1148,37 @@ def compute_query_tfidf(
     exact_match_words = given_ids.union(not_word_ids)
 
     if query.strip() != '':
-        query_tf_dict, must_inc_word = extract_keywords(query, is_query=True)
+        query_tf_dict, must_inc_word = analyze_query(query)
         if len(query_tf_dict) > 0:
             exact_match_words = exact_match_words.union(set(query_tf_dict.keys()))
             where_clause = Keyword.word.in_(set(query_tf_dict.keys()).union(must_inc_word))
             if fuzzy_matched:
                 where_clause = or_(Keyword.word.like(f'%{i}%') for i in query_tf_dict.keys())
 
-            terms = db.query(Keyword.word_id, Keyword.word).filter(where_clause).all()
-            terms = {i[1]: i[0] for i in terms}
+            fuzzy_matches: dict[str, list[str]] = dict() # query word: matched keywords
+            if fuzzy_matched and use_fuzzy_index:
+                fuzzy_index = get_fuzzy_index()
+                fuzzy_matches = {
+                    k: [fuzzy_index.words[i] for i in fuzzy_index.match(k)] for k in query_tf_dict.keys()
+                }
+                terms = {
+                    fuzzy_index.words[i]: i for i in sorted({
+                        i for k in query_tf_dict.keys() for i in fuzzy_index.match(k)
+                    })
+                }
+            else:
+                terms = db.query(Keyword.word_id, Keyword.word).filter(where_clause).all()
+                terms = {i[1]: i[0] for i in terms}
             terms_ids.update({i[0]: i[1] for i in terms})
 
             for k in must_inc_word:
+                # phrases are matched with the positional index instead
+                if use_positional_index and ' ' in k: continue
                 must_inc.add(terms.get(k, -1))
             
             for k, v in query_tf_dict.items():
                 if fuzzy_matched:
-                    w = [i for i in terms.keys() if k in i]
+                    w = fuzzy_matches[k] if k in fuzzy_matches else [i for i in terms.keys() if k in i]
                     if len(w) > 0: 
                         query_tf.update({
                             terms[a]: v * substring_probability(k, a) for a in w if a in terms.keys()
@@ -634,26 +1222,30 @@ def compute_co_occurence_tfidf(
     db=Session()) -> dict[int, float]: # word_id: pmi
 
     pmi_word_tfs: dict[int, float] = dict()
-    max_pmi = db.query(func.max(PMI.pmi)).scalar_subquery()
-
-    pmi = db.query(
-        PMI.word1_id.label('word1'), 
-        PMI.word2_id.label('word2'), 
-        (PMI.pmi / max_pmi * co_occurence_weight).label('pmi'),
-    ).filter(or_(
-        PMI.word1_id.in_(query_tfs.keys()), 
-        PMI.word2_id.in_(query_tfs.keys())
-    )).all()
+    if use_pmi_graph:
+        pmi_word_tfs = get_pmi_graph().expand(query_tfs)
+        if len(pmi_word_tfs) == 0: return dict()
+    else:
+        max_pmi = db.query(func.max(PMI.pmi)).scalar_subquery()
+
+        pmi = db.query(
+            PMI.word1_id.label('word1'), 
+            PMI.word2_id.label('word2'), 
+            (PMI.pmi / max_pmi * co_occurence_weight).label('pmi'),
+        ).filter(or_(
+            PMI.word1_id.in_(query_tfs.keys()), 
+            PMI.word2_id.in_(query_tfs.keys())
+        )).all()
 
-    if pmi is None or len(pmi) == 0:
-        return dict()
+        if pmi is None or len(pmi) == 0:
+            return dict()
 
-    for i in pmi:
-        if i[0] not in query_tfs:
-            pmi_word_tfs[i[0]] = i[2] * query_tfs[i[1]]
+        for i in pmi:
+            if i[0] not in query_tfs:
+                pmi_word_tfs[i[0]] = i[2] * query_tfs[i[1]]
 
-        if i[1] not in query_tfs:
-            pmi_word_tfs[i[1]] = i[2] * query_tfs[i[0]]
+            if i[1] not in query_tfs:
+                pmi_word_tfs[i[1]] = i[2] * query_tfs[i[0]]
 
     if require_idf:
         tfidf = compute_tfidf(pmi_word_tfs, is_title=None, db=db)
@@ -668,6 +1260,10 @@ def compute_co_occurence_tfidf(
 def compute_tfidf(tf: dict[int, float], is_title: bool | None, db=Session()) -> dict[int, float]:
     wid = set(tf.keys())
     if len(wid) <= 0: return dict()
+    if scoring_backend == 'index': return get_index().compute_tfidf(tf, is_title=is_title)
+    if use_document_frequency:
+        idf = get_idf(wid, is_title=is_title, db=db)
+        if idf is not None: return {word: index * idf.get(word, 0) for word, index in tf.items()}
 
     def idf_query(wid: set[int], is_title: bool):
         idf_n = db.query(func.count(Webpage.webpage_id)).filter(and_(
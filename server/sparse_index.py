@@ -0,0 +1,154 @@
+from scipy.sparse import csr_matrix
+from db.schemas import *
+from db.database import *
+from cache import on_index_change
+from math import sqrt
+import numpy as np
+import os
+import threading
+
+class SparseIndex:
+    def __init__(
+        self,
+        page_ids: np.ndarray,
+        word_ids: np.ndarray,
+        matrix: csr_matrix,
+        norms: np.ndarray,
+        pageranks: np.ndarray,
+        max_pagerank: float,
+        min_pagerank: float,
+        generation: int,
+    ):
+        # one row per page and one column per word, holding the combined title/body tfidf
+        # built at index generation, the ids of another generation may belong to other rows
+        self.page_ids = page_ids
+        self.word_ids = word_ids
+        self.matrix = matrix
+        self.norms = norms
+        self.pageranks = pageranks
+        self.max_pagerank = max_pagerank
+        self.min_pagerank = min_pagerank
+        self.generation = generation
+        self.rows: dict[int, int] = {int(p): i for i, p in enumerate(page_ids)}
+        self.columns: dict[int, int] = {int(w): i for i, w in enumerate(word_ids)}
+
+    def query_vector(self, query_tfidfs: dict[int, float]) -> tuple[np.ndarray, float]:
+        vector = np.zeros(len(self.word_ids))
+        norm = 0
+        for word_id, v in query_tfidfs.items():
+            norm += v ** 2
+            if word_id in self.columns: vector[self.columns[word_id]] = v
+        return vector, sqrt(norm)
+
+    def score(
+        self,
+        original_query_tfidf: dict[int, float],
+        modified_query_tfidfs: dict[int, float],
+        webpage_ids: list[int],
+    ) -> dict[int, tuple[float, float]]: # webpage_id: (original score, modified score)
+        # pages without a row are left out, see score_webpages of search.py
+        webpage_ids = [i for i in webpage_ids if i in self.rows]
+        if len(webpage_ids) <= 0: return dict()
+        rows = np.array([self.rows[i] for i in webpage_ids])
+
+        original, original_norm = self.query_vector(original_query_tfidf)
+        modified, modified_norm = self.query_vector(modified_query_tfidfs)
+        # original and modified query scored with a single sparse mat-vec
+        dots = self.matrix[rows] @ np.stack([original, modified], axis=1)
+        norms = self.norms[rows]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            original_score = np.where(
+                (norms != 0) & (original_norm != 0), dots[:, 0] / (original_norm * norms), 0
+            )
+            modified_score = np.where(
+                (norms != 0) & (modified_norm != 0), dots[:, 1] / (modified_norm * norms), 0
+            )
+            modified_score = modified_score * (1 - pagerank_weight) + pagerank_weight * (
+                self.pageranks[rows] - self.min_pagerank
+            ) / (self.max_pagerank - self.min_pagerank)
+
+        return {
+            webpage_id: (float(original_score[i]), float(modified_score[i]))
+            for i, webpage_id in enumerate(webpage_ids)
+        }
+
+    def save(self, path: str = sparse_index_path):
+        np.savez_compressed(
+            path, page_ids=self.page_ids, word_ids=self.word_ids,
+            data=self.matrix.data, indices=self.matrix.indices, indptr=self.matrix.indptr,
+            norms=self.norms, pageranks=self.pageranks,
+            pagerank_range=np.array([self.max_pagerank, self.min_pagerank]),
+            generation=np.array([self.generation]),
+        )
+
+    @staticmethod
+    def load(path: str = sparse_index_path) -> 'SparseIndex':
+        with np.load(path) as f:
+            return SparseIndex(
+                page_ids=f['page_ids'], word_ids=f['word_ids'],
+                matrix=csr_matrix(
+                    (f['data'], f['indices'], f['indptr']),
+                    shape=(len(f['page_ids']), len(f['word_ids']))
+                ),
+                norms=f['norms'], pageranks=f['pageranks'],
+                max_pagerank=float(f['pagerank_range'][0]), min_pagerank=float(f['pagerank_range'][1]),
+                generation=int(f['generation'][0]) if 'generation' in f else -1,
+            )
+
+def build_sparse_index(path: str | None = sparse_index_path) -> SparseIndex:
+    # built from the materialized page vectors
+    with Session() as db:
+        if db.query(func.count(PageNorm.webpage_id)).scalar() <= 0: compute_page_vectors()
+
+        norms = db.query(PageNorm.webpage_id, PageNorm.norm).order_by(PageNorm.webpage_id).all()
+        weights = db.query(PageWeight.webpage_id, PageWeight.word_id, PageWeight.tfidf).all()
+        pageranks = {i[0]: i[1] for i in db.query(Webpage.webpage_id, Webpage.pagerank).filter(
+            Webpage.webpage_id.in_(select(PageNorm.webpage_id))
+        ).all()}
+        max_pagerank, min_pagerank = db.query(func.max(Webpage.pagerank), func.min(Webpage.pagerank)).first()
+        generation = get_index_generation(db=db)
+
+    page_ids = np.array([i[0] for i in norms], dtype=np.int64)
+    word_ids = np.array(sorted({i[1] for i in weights}), dtype=np.int64)
+    rows = {int(p): i for i, p in enumerate(page_ids)}
+    columns = {int(w): i for i, w in enumerate(word_ids)}
+
+    matrix = csr_matrix(
+        (
+            np.array([i[2] for i in weights], dtype=np.float64),
+            (np.array([rows[i[0]] for i in weights]), np.array([columns[i[1]] for i in weights])),
+        ),
+        shape=(len(page_ids), len(word_ids))
+    )
+    index = SparseIndex(
+        page_ids=page_ids, word_ids=word_ids, matrix=matrix,
+        norms=np.array([i[1] for i in norms], dtype=np.float64),
+        pageranks=np.array([pageranks[int(i)] for i in page_ids], dtype=np.float64),
+        max_pagerank=max_pagerank, min_pagerank=min_pagerank, generation=generation,
+    )
+    if path is not None: index.save(path)
+    return index
+
+sparse_index: SparseIndex | None = None
+sparse_index_lock = threading.Lock()
+
+@on_index_change
+def reset_sparse_index():
+    global sparse_index
+    sparse_index = None
+
+def get_sparse_index() -> SparseIndex:
+    global sparse_index
+    if sparse_index is None:
+        with sparse_index_lock:
+            if sparse_index is None: load_sparse_index()
+    return sparse_index
+
+def load_sparse_index() -> SparseIndex:
+    global sparse_index
+    # a file left by an earlier crawl is rebuilt instead of loaded
+    index = SparseIndex.load(sparse_index_path) if os.path.exists(sparse_index_path) else None
+    with Session() as db: generation = get_index_generation(db=db)
+    sparse_index = index if index is not None and index.generation == generation else build_sparse_index()
+    return sparse_index
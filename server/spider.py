@@ -1,98 +1,244 @@
 from collections import deque
-from concurrent.futures import Future, ThreadPoolExecutor
-from typing import Iterable
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import AsyncIterator, Iterable
 import requests
-from bs4 import BeautifulSoup as bs
+import httpx
+import asyncio
 from sqlalchemy import text
 from utils import *
 import time
+import os
+import json
 from db.database import *
 from queue import Queue
-
-url_visited: set[str] = set()
-inactive_url = set()
-page_count = 0
-url_queue = Queue()
+from urllib.parse import urlparse
+from frontier import Frontier
+from page_parser import parse_html
+from warc import WarcWriter, WarcArchive, ReplayAdapter, ReplayTransport
+import threading
+
+frontier: Frontier | None = None # opened by the crawlers
+recorder: WarcWriter | None = None
+replay_archive: WarcArchive | None = None
+replay_session: requests.Session | None = None
 page_ids: set[int] = set()
 word_ids: set[int] = set()
-
-def fetch_page(url: str) -> tuple[Any, str, str, set[str]] | None:
-    global url_visited, inactive_url, page_count, url_queue
-    if url in url_visited: return None
-
+# incremental crawls only
+validators: dict[str, tuple[Any, str | None, str | None]] = dict() # url: (last modified date, etag, content hash)
+stored_links: dict[str, list[str]] = dict() # url: child urls
+unchanged_count = 0
+
+def load_validators():
+    global validators, stored_links
+    with Session() as db:
+        validators = get_crawl_validators(db=db)
+        stored_links = get_child_links(db=db)
+
+def conditional_headers(url: str) -> dict[str, str]:
+    if url not in validators: return dict()
+    last_modified_date, etag, _ = validators[url]
+    headers = dict()
+    if etag is not None: headers['If-None-Match'] = etag
+    if last_modified_date is not None: headers['If-Modified-Since'] = date_to_str(last_modified_date)
+    return headers
+
+def is_unchanged(url: str, status_code: int, page: str) -> bool:
+    # not modified since the last crawl, or modified to the same html
+    if url not in validators: return False
+    return status_code == 304 or validators[url][2] == content_hash(page)
+
+def skip_unchanged(url: str) -> list[str]:
+    # the rows of an unchanged page are kept and checkpointed, its stored children are crawled
+    global unchanged_count
+    unchanged_count += 1
+    frontier.saved([url])
+    return stored_links.get(url, list())
+
+def open_archives(record_path: str | None, replay_path: str | None):
+    global recorder, replay_archive, replay_session
+    recorder = WarcWriter(record_path) if record_path is not None else None
+    replay_archive, replay_session = None, None
+    if replay_path is not None:
+        replay_archive = WarcArchive(replay_path, latency=replay_latency)
+        replay_session = requests.Session()
+        replay_session.mount('http://', ReplayAdapter(replay_archive))
+        replay_session.mount('https://', ReplayAdapter(replay_archive))
+
+def record_response(response: requests.Response | httpx.Response, body: bytes):
+    # under the url first requested, which is looked up when replaying
+    if recorder is None: return
+    first = response.history[0] if len(response.history) > 0 else response
+    reason = response.reason if isinstance(response, requests.Response) else response.reason_phrase
+    recorder.write(str(first.request.url), response.status_code, reason, response.headers.items(), body)
+
+def is_html(headers) -> bool:
+    # pages without a content type are parsed as html
+    content_type = headers.get('Content-Type', '').split(';')[0].strip().lower()
+    return content_type == '' or content_type in crawl_content_types
+
+def read_page(chunks: Iterable[bytes]) -> bytes:
+    # at most max_page_bytes, the rest of a larger page is not downloaded
+    body = bytearray()
+    for chunk in chunks:
+        body += chunk
+        if len(body) >= max_page_bytes: break
+    return bytes(body[:max_page_bytes])
+
+async def read_page_async(chunks: AsyncIterator[bytes]) -> bytes:
+    body = bytearray()
+    async for chunk in chunks:
+        body += chunk
+        if len(body) >= max_page_bytes: break
+    return bytes(body[:max_page_bytes])
+
+def fetch_failed(url: str):
+    frontier.failed(url)
+    if url == seed_url: frontier.push([backup_url])
+
+def fetch_page(url: str) -> tuple[Any, str | None, str] | None:
+    # headers, page, url, links are extracted in the parser processes
+    # page is None if unchanged since the last crawl
     try:
         print(f'Fetching {url}...')
-        response = requests.get(url, allow_redirects=True)
+        get = replay_session.get if replay_session is not None else requests.get
+        with get(url, allow_redirects=True, headers=conditional_headers(url), stream=True) as response:
+            crawlable = response.status_code < 400 and is_html(response.headers)
+            body = read_page(response.iter_content(fetch_chunk_size)) if crawlable else b''
+        record_response(response, body)
         response.raise_for_status()
+        if not crawlable:
+            print(f'Skipped {url}: {response.headers.get("Content-Type")} is not crawled')
+            fetch_failed(url)
+            return None
         print(f'Finish fetching {url}...')
-
-        page = response.text
-        soup = bs(page, 'html.parser')
-        child_links: set[str] = set()
-        links = soup.find_all('a', href=True)
-        url_visited.add(url)
-
-        for link in links:
-            link = link['href']
-            link = normalize_url(link, url)
-            if link is not None and (not remove_cyclic_relationship or link not in url_visited): 
-                child_links.add(link)
-                if url_queue.qsize() + page_count < max_page: url_queue.put(link)
-
-        page_count += 1
-
-        return response.headers, response.text, url, child_links
+        frontier.fetched(url)
+        page = body.decode(response.encoding or 'utf-8', errors='replace')
+        if is_unchanged(url, response.status_code, page): return response.headers, None, url
+        return response.headers, page, url
     except requests.RequestException as e:
         print(f"Failed to fetch {url}: {e}")
-        inactive_url.add(url)
+        fetch_failed(url)
         return None
     except Exception as e:
         print(f'Unknown error: {e}')
-        inactive_url.add(url)
+        fetch_failed(url)
         return None
 
-def extract_page_keywords(
-    text: str, url: str, is_title: bool = True
-    ) -> tuple[list[TitleIndex] | list[BodyIndex], set[str]]:
+async def fetch_page_async(
+    url: str, client: httpx.AsyncClient, host_limits: dict[str, asyncio.Semaphore]
+) -> tuple[Any, str | None, str] | None:
+    # same as fetch_page, with at most max_host_connections requests to a host at a time
+    host = urlparse(url).netloc
+    if host not in host_limits: host_limits[host] = asyncio.Semaphore(max_host_connections)
+    try:
+        async with host_limits[host]:
+            print(f'Fetching {url}...')
+            async with client.stream('GET', url, headers=conditional_headers(url)) as response:
+                crawlable = response.status_code < 400 and is_html(response.headers)
+                body = await read_page_async(response.aiter_bytes(fetch_chunk_size)) if crawlable else b''
+        record_response(response, body)
+        # httpx raises for 304 as a redirect
+        if response.status_code != 304: response.raise_for_status()
+        if not crawlable:
+            print(f'Skipped {url}: {response.headers.get("Content-Type")} is not crawled')
+            fetch_failed(url)
+            return None
+        print(f'Finish fetching {url}...')
+        frontier.fetched(url)
+        page = body.decode(response.encoding or 'utf-8', errors='replace')
+        if is_unchanged(url, response.status_code, page): return response.headers, None, url
+        return response.headers, page, url
+    except httpx.HTTPError as e:
+        print(f"Failed to fetch {url}: {e}")
+        fetch_failed(url)
+        return None
+    except Exception as e:
+        print(f'Unknown error: {e}')
+        fetch_failed(url)
+        return None
 
-    keywords_dict, _ = extract_keywords(text, is_query=False)
+def extract_keyword_records(text: str) -> list[tuple[str, int, float, bytes | None]]:
+    # word, frequency, normalized tf, encoded positions
+    keywords_dict, positions = index_text(text, extract_phrases=index_rake_phrases)
     max_tf = max(keywords_dict.values())
+    return [(
+        word.strip(), freq, freq / max_tf,
+        encode_positions(positions[word]) if word in positions else None,
+    ) for word, freq in keywords_dict.items() if len(word.strip()) > 0]
+
+def to_indexes(
+    records: list[tuple[str, int, float, bytes | None]], url: str, is_title: bool = True
+) -> list[TitleIndex] | list[BodyIndex]:
     cls = TitleIndex if is_title else BodyIndex
-    # return index list, keywords
     return [
         cls(
-            webpage=Webpage(url=url), keyword=Keyword(word=word.strip()), 
-            frequency=freq, normalized_tf = freq / max_tf 
-        ) for word, freq in keywords_dict.items() if len(word.strip()) > 0
-    ], set(keywords_dict.keys())
-    
-def extract_infos(
+            webpage=Webpage(url=url), keyword=Keyword(word=word), 
+            frequency=freq, normalized_tf=normalized_tf, positions=positions,
+        ) for word, freq, normalized_tf, positions in records
+    ]
+
+def extract_page_keywords(
+    text: str, url: str, is_title: bool = True
+    ) -> tuple[list[TitleIndex] | list[BodyIndex], set[str]]:
+    records = extract_keyword_records(text)
+    # return index list, keywords
+    return to_indexes(records, url=url, is_title=is_title), {a[0] for a in records}
+
+def extract_record(
     parent_url: str, 
     info: tuple[Any, str] | None,
-) -> tuple[Webpage, list[TitleIndex], list[BodyIndex], set[str]] | None: 
-    # retrun webpage, parent-child relationship, index list, keywords, children links
+) -> dict[str, Any] | None:
+    # plain data of a fetched page, parsed in the parser processes while crawling
     if info is None: return None
 
     headers, page = info
-    soup = bs(page, 'html.parser')
+    # title, links and text in one pass
+    title, hrefs, body = parse_html(page)
 
     # Extract basic infos
     last_modified_date = headers.get('Last-Modified', headers.get('Date', ''))
     size = headers.get('Content-Length', len(page))
-    title = soup.title.string if soup.title else ''
+    title = title if title is not None else ''
 
     # Extract child links
-    body = soup.get_text()
-
-    title_indexes, title_keywords = extract_page_keywords(title, url=parent_url, is_title=True)
-    body_indexes, body_keywords = extract_page_keywords(body, url=parent_url, is_title=False)
-
-    keywords: set[str] = title_keywords.union(body_keywords)
-
+    links = [normalize_url(href, parent_url) for href in hrefs]
+    body_keywords = extract_keyword_records(body)
+
+    return {
+        'url': parent_url,
+        'title': title,
+        'size': size,
+        'last_modified_date': str_to_date(last_modified_date),
+        'etag': headers.get('ETag', None),
+        'content_hash': content_hash(page),
+        'links': [link for link in links if link is not None],
+        'title_keywords': extract_keyword_records(title),
+        'body_keywords': body_keywords,
+        'simhash': simhash({word: freq for word, freq, _, _ in body_keywords}),
+    }
+
+def to_webpage(record: dict[str, Any]) -> Webpage:
     return Webpage(
-        url=parent_url, title=title, size=size, is_active=True, is_crawled=True,
-        last_modified_date=str_to_date(last_modified_date), 
-    ), title_indexes, body_indexes, keywords
+        url=record['url'], title=record['title'], size=record['size'], is_active=True, is_crawled=True,
+        last_modified_date=record['last_modified_date'], etag=record['etag'],
+        content_hash=record['content_hash'], simhash=record['simhash'], links=json.dumps(record['links']),
+    )
+
+def to_infos(record: dict[str, Any]) -> tuple[Webpage, list[TitleIndex], list[BodyIndex], set[str]]:
+    url = record['url']
+    return to_webpage(record), (
+        to_indexes(record['title_keywords'], url=url, is_title=True)
+    ), (
+        to_indexes(record['body_keywords'], url=url, is_title=False)
+    ), {a[0] for a in record['title_keywords']}.union(a[0] for a in record['body_keywords'])
+    
+def extract_infos(
+    parent_url: str, 
+    info: tuple[Any, str] | None,
+) -> tuple[Webpage, list[TitleIndex], list[BodyIndex], set[str]] | None: 
+    # retrun webpage, parent-child relationship, index list, keywords, children links
+    record = extract_record(parent_url, info)
+    return to_infos(record) if record is not None else None
 
 def save_to_db_immediately(
     webpage: Webpage,
@@ -145,6 +291,7 @@ def save_to_db_immediately(
                     word_id=word_id_dict[index.keyword.word],
                     frequency=index.frequency,
                     normalized_tf=index.normalized_tf,
+                    positions=index.positions,
                 ))
             set_title_index(
                 index_list, db=sess, 
@@ -160,6 +307,7 @@ def save_to_db_immediately(
                     word_id=word_id_dict[index.keyword.word],
                     frequency=index.frequency,
                     normalized_tf=index.normalized_tf,
+                    positions=index.positions,
                 ))
             set_body_index(
                 index_list, db=sess, 
@@ -168,20 +316,11 @@ def save_to_db_immediately(
 
     return page_ids, word_ids
 
-def crawl_webpage(url: str, info: tuple[Any, str] | None, child_links: set[str]):
-    global url_visited, inactive_url, page_ids, word_ids, url_queue, lock
+def crawl_webpage(url: str, record: dict[str, Any] | None, child_links: set[str], db = Session()):
+    global page_ids, word_ids
+    if record == None: return
 
-    page_info = extract_infos(url, info)
-    if page_info == None: 
-        if url == seed_url: url_queue.put(backup_url)
-        inactive_url.add(url)
-        url_visited.add(url)
-        return
-
-    webpage, title_indexes, body_indexes, keywords = page_info
-    
-    lock.acquire()
-    db = Session()
+    webpage, title_indexes, body_indexes, keywords = to_infos(record)
     p, w = save_to_db_immediately(
         webpage=webpage,
         title_indexes=title_indexes,
@@ -192,35 +331,203 @@ def crawl_webpage(url: str, info: tuple[Any, str] | None, child_links: set[str])
         delete_unfound_item=delete_unfounded_item
     )
     db.commit()
-    db.close()
     page_ids.update(p)
     word_ids.update(w)
-    lock.release()
-
-def bfs_crawl(max_page: int = max_page):
-    global url_visited, inactive_url, page_count, page_ids, word_ids, url_queue
-    url_queue.put(seed_url)
 
-    def future_callback(future: Future[tuple[Any, str, str, set[str]] | None]):
-        result = future.result()
-        if result == None: return
-        else: crawl_webpage(info=(result[0], result[1]), url=result[2], child_links=result[3])
-            
-    
-    with ThreadPoolExecutor(max_workers=max_thread_worker*2) as executor:
-        while page_count < max_page:
-            try:
-                url = url_queue.get(timeout=15)
-                future = executor.submit(fetch_page, url)
-                future.add_done_callback(fn=future_callback)
-            except: break
+def crawl_webpages(items: list[tuple[str, dict[str, Any] | None, set[str]]], db = Session()):
+    # near duplicates of indexed pages are saved as links to them instead of being indexed
+    crawled = [(record, child_links) for _, record, child_links in items if record is not None]
+    if len(crawled) <= 0: return
+    canonicals = get_near_duplicates([(record['url'], record['simhash']) for record, _ in crawled], db=db) if detect_near_duplicates else dict()
+    save_webpages([i for i in crawled if i[0]['url'] not in canonicals], db=db)
+    if len(canonicals) <= 0: return
+    try:
+        saved = set_duplicate_pages([(to_webpage(record), canonicals[record['url']]) for record, _ in crawled if record['url'] in canonicals], db=db)
+        if frontier is not None: frontier.saved(saved.keys())
+    except Exception as e:
+        print(f'Failed to save {len(canonicals)} near duplicate pages: {e}')
+        db.rollback()
+
+def save_webpages(crawled: list[tuple[dict[str, Any], set[str]]], db = Session()):
+    # pages saved in one transaction, or one by one if the group fails
+    # saved pages are checkpointed in the frontier, the others are fetched again by a resumed crawl
+    global page_ids, word_ids
+    if len(crawled) <= 0: return
+    if not delete_unfounded_item:
+        try:
+            p, w = set_crawled_pages(crawled, db=db)
+            page_ids.update(p)
+            word_ids.update(w)
+            if frontier is not None: frontier.saved([record['url'] for record, _ in crawled])
+            return
+        except Exception as e:
+            print(f'Failed to save {len(crawled)} pages at once: {e}')
+            db.rollback()
+
+    for record, child_links in crawled:
+        try: 
+            crawl_webpage(record['url'], record, child_links, db=db)
+            if frontier is not None: frontier.saved([record['url']])
+        except Exception as e: 
+            print(f'Failed to save {record["url"]}: {e}')
+            db.rollback()
+
+def write_pages(write_queue: Queue):
+    # the only thread writing to the database while crawling, None stops it
+    # pages queued while a group is written are committed together, up to bulk_write_limit pages
+    with Session() as db:
+        stopped = False
+        while not stopped:
+            items = [write_queue.get()]
+            while len(items) < bulk_write_limit and items[-1] is not None and not write_queue.empty():
+                items.append(write_queue.get())
+            if items[-1] is None:
+                stopped = True
+                items.pop()
+            crawl_webpages(items, db=db)
+
+def start_stages() -> tuple[ProcessPoolExecutor, Queue, threading.Thread]:
+    # parser processes and the writer thread shared by both crawlers
+    write_queue = Queue()
+    writer = threading.Thread(target=write_pages, args=(write_queue,))
+    parsers = ProcessPoolExecutor(max_workers=max_parse_worker)
+    # parser processes are started before any other thread exists
+    parsers.submit(int).result()
+    writer.start()
+    return parsers, write_queue, writer
+
+def stop_stages(parsers: ProcessPoolExecutor, write_queue: Queue, writer: threading.Thread):
+    parsers.shutdown(wait=True)
+    write_queue.put(None)
+    writer.join()
+    if recorder is not None: recorder.close()
 
     with Session() as sess:
+        if len(validators) > 0:
+            # pages of the last crawl that failed to be fetched or parsed are no longer searched
+            # pages not reached, e.g. over max_page, keep their rows
+            stale = set(validators).intersection(frontier.failed_urls())
+            set_inactive_pages(stale, db=sess)
+            print(f'{len(stale)} webpages of the last crawl deactivated.')
         i = sess.query(func.count(Webpage.is_active)).filter(Webpage.is_crawled == True).scalar()
         print(f'Total {i} webpages crawled.')
+        if incremental_crawl: print(f'{unchanged_count} unchanged webpages skipped.')
+        bump_index_generation(db=sess)
+    # built again from the new index by bonus.py or the server
+    if os.path.exists(sparse_index_path): os.remove(sparse_index_path)
+    frontier.close()
+
+def open_frontier(resume: bool, max_page: int) -> Frontier:
+    # a replay fetches only recorded urls, the others would fail without counting toward max_page
+    # and the crawl would depend on thread timing
+    global frontier
+    accept = (lambda url: replay_archive.get(url) is not None) if replay_archive is not None else None
+    frontier = Frontier(resume=resume, max_page=max_page, accept=accept)
+    frontier.push([seed_url])
+    return frontier
+
+def bfs_crawl(
+    max_page: int = max_page, resume: bool = resume_crawl,
+    record_path: str | None = record_crawl_path, replay_path: str | None = replay_crawl_path,
+):
+    # fetch threads -> parser processes -> writer thread
+    open_archives(record_path, replay_path)
+    open_frontier(resume, max_page)
+    parsers, write_queue, writer = start_stages()
+
+    # every exit of the callbacks marks the url done, or the crawl waits for it forever
+    def parse_callback(url: str, future: Future[dict[str, Any] | None]):
+        links, parsed = list(), False
+        try:
+            record = future.result()
+            links = record['links'] if record is not None else list()
+            parsed = True
+        except Exception as e:
+            print(f'Failed to parse {url}: {e}')
+            frontier.failed(url)
+        finally:
+            child_links = frontier.done(url, links)
+        if parsed: write_queue.put((url, record, child_links))
+
+    def fetch_callback(url: str, future: Future[tuple[Any, str | None, str] | None]):
+        links, parsing = list(), False
+        try:
+            result = future.result()
+            if result is None: return
+            headers, page, url = result
+            if page is None:
+                links = skip_unchanged(url)
+                return
+            # e.g. BrokenProcessPool after a parser process is killed
+            parsers.submit(extract_record, url, (headers, page)).add_done_callback(lambda f: parse_callback(url, f))
+            parsing = True
+        except Exception as e:
+            print(f'Failed to parse {url}: {e}')
+            frontier.failed(url)
+        finally:
+            if not parsing: frontier.done(url, links)
+    
+    with ThreadPoolExecutor(max_workers=max_thread_worker*2) as executor:
+        # pages being fetched or parsed are bounded, the crawl ends when none is left and nothing is queued
+        while (url := frontier.next(max_in_flight=max_thread_worker*4)) is not None:
+            future = executor.submit(fetch_page, url)
+            future.add_done_callback(lambda f, url=url: fetch_callback(url, f))
+    stop_stages(parsers, write_queue, writer)
+
+async def async_crawl(
+    max_page: int = max_page, resume: bool = resume_crawl,
+    record_path: str | None = record_crawl_path, replay_path: str | None = replay_crawl_path,
+):
+    # fetch coroutines on one thread sharing a keep-alive connection pool -> parser processes -> writer thread
+    open_archives(record_path, replay_path)
+    open_frontier(resume, max_page)
+    parsers, write_queue, writer = start_stages()
+    loop = asyncio.get_running_loop()
+    host_limits: dict[str, asyncio.Semaphore] = dict()
+    page_done = asyncio.Condition()
+
+    async def crawl_page(url: str, client: httpx.AsyncClient):
+        # every exit marks the url done, or the crawl waits for it forever
+        links, parsed = list(), False
+        try:
+            result = await fetch_page_async(url, client, host_limits)
+            if result is None: return
+            headers, page, url = result
+            if page is None:
+                links = skip_unchanged(url)
+                return
+            record = await loop.run_in_executor(parsers, extract_record, url, (headers, page))
+            links = record['links'] if record is not None else list()
+            parsed = True
+        except Exception as e:
+            print(f'Failed to parse {url}: {e}')
+            frontier.failed(url)
+        finally:
+            child_links = frontier.done(url, links)
+        if parsed: write_queue.put((url, record, child_links))
+
+    async def crawl(client: httpx.AsyncClient):
+        # until nothing is queued or in flight
+        while True:
+            url = frontier.pop()
+            if url is None:
+                if frontier.in_flight <= 0: return
+                async with page_done: await page_done.wait()
+                continue
+            try: await crawl_page(url, client)
+            finally:
+                async with page_done: page_done.notify_all()
+
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+    transport = ReplayTransport(replay_archive) if replay_archive is not None else None
+    async with httpx.AsyncClient(limits=limits, timeout=fetch_timeout, follow_redirects=True, transport=transport) as client:
+        await asyncio.gather(*[crawl(client) for _ in range(max_connections)])
+    stop_stages(parsers, write_queue, writer)
 
 if __name__ == '__main__':
     time_start = time.time()
-    create_database(restore=True)
-    bfs_crawl()
+    create_database(restore=not (incremental_crawl or resume_crawl))
+    if incremental_crawl: load_validators()
+    if use_async_crawler: asyncio.run(async_crawl())
+    else: bfs_crawl()
     print('Time taken:', time.time() - time_start)
\ No newline at end of file
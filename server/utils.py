@@ -1,13 +1,17 @@
 import re
-from urllib.parse import urlparse
-import os
+import hashlib
+from urllib.parse import urljoin, urlparse, urlunparse
+import posixpath
 from datetime import datetime
 from typing import Any, Callable
 from collections import Counter
-from nltk.tokenize import word_tokenize
+from functools import lru_cache
+from itertools import groupby
+from nltk.tokenize import word_tokenize, wordpunct_tokenize
 from nltk.stem import PorterStemmer
 from rake_nltk import Rake
 import nltk, string
+from constant import stem_cache_size
 
 def is_url_valid(url: str) -> bool:
     try:
@@ -17,35 +21,52 @@ def is_url_valid(url: str) -> bool:
         return False
 # pip install sqlalchemy requests nltk rake-nltk beautifulsoup4 --user
 def str_to_date(date: str): return datetime.strptime(date, '%a, %d %b %Y %H:%M:%S %Z')
+def date_to_str(date: datetime): return date.strftime('%a, %d %b %Y %H:%M:%S GMT')
+def content_hash(page: str) -> str: return hashlib.sha1(page.encode()).hexdigest()
+repeated_slash = re.compile(r'/{2,}')
     
+def canonicalize_url(url: str) -> str:
+    # one url per page: lowercase scheme and host, no default port, dot segments, repeated slashes or fragment,
+    # query parameters sorted
+    parsed = urlparse(url)
+    scheme = parsed.scheme.lower()
+    netloc = parsed.netloc.rsplit('@', 1)[-1].lower()
+    if (scheme, netloc.rsplit(':', 1)[-1]) in (('http', '80'), ('https', '443')): netloc = netloc.rsplit(':', 1)[0]
+    if '@' in parsed.netloc: netloc = f'{parsed.netloc.rsplit("@", 1)[0]}@{netloc}'
+
+    path = posixpath.normpath(repeated_slash.sub('/', parsed.path)) if parsed.path != '' else '/'
+    if parsed.path.endswith('/') and not path.endswith('/'): path += '/'
+    query = '&'.join(sorted(p for p in parsed.query.split('&') if p != ''))
+    return urlunparse((scheme, netloc, path, parsed.params, query, ''))
+
 def normalize_url(url: str, parent_url: str) -> str | None:
     url = url.strip()
     parsed_url = urlparse(url)
 
     # absolute path
     if parsed_url.netloc != '' and parsed_url.scheme != '': 
-        return url if is_url_valid(url) else None
+        return canonicalize_url(url) if is_url_valid(url) else None
     
     parent_url = parent_url.strip()
     if not is_url_valid(parent_url): return None
-    parsed_parent_url = urlparse(parent_url)
-
-    norm_link = None
-    relative_path = parsed_url.path
-    # relative path with leading double slash
-    if parsed_url.netloc != '' and parsed_url.scheme == '':
-        norm_link = f'{parsed_parent_url.scheme}:{parsed_url.netloc}{relative_path}'
-    # relative path with leading single slash
-    elif relative_path.startswith('/'):
-        norm_link = f'{parsed_parent_url.scheme}://{parsed_parent_url.netloc}{relative_path}'
-    else:
-        path = None
-        if parent_url.endswith('/'): path = f'{parsed_parent_url.path}{relative_path}'
-        else: path = f'{os.path.dirname(parsed_parent_url.path)}/{relative_path}'
-        path = os.path.normpath(path).replace('\\', '/')
-        norm_link = f'{parsed_parent_url.scheme}://{parsed_parent_url.netloc}{path}'
-
-    return norm_link if is_url_valid(norm_link) else None
+
+    # relative path, with leading double slash, single slash or none
+    norm_link = urljoin(parent_url, url)
+    return canonicalize_url(norm_link) if is_url_valid(norm_link) else None
+
+def simhash(features: dict[str, float]) -> int | None:
+    # 64 bit fingerprint as a signed integer for sqlite, near duplicate texts differ in a few bits
+    if len(features) <= 0: return None
+    weights = [0.0] * 64
+    for feature, weight in features.items():
+        h = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), 'big')
+        for i in range(64):
+            weights[i] += weight if h >> i & 1 else -weight
+    fingerprint = sum(1 << i for i in range(64) if weights[i] > 0)
+    return fingerprint - (1 << 64) if fingerprint >= 1 << 63 else fingerprint
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin((a ^ b) & 0xffffffffffffffff).count('1')
 
 stopword = None
 def get_stopwords() -> set[str]:
@@ -56,21 +77,35 @@ def get_stopwords() -> set[str]:
 
     return stopword
 
-nltk.download('punkt')
+def download_nltk_data():
+    # only missing data, importing does not need the network
+    for path, name in (('tokenizers/punkt_tab', 'punkt_tab'), ('corpora/stopwords', 'stopwords')):
+        try: nltk.data.find(path)
+        except LookupError: nltk.download(name)
+
+download_nltk_data()
 stemmer = PorterStemmer()
 rake = Rake()
-def extract_keywords(text: str, is_query: bool = False) -> tuple[dict[str, int], set[str]]:
+
+punctuation_table = str.maketrans({c: ' ' for c in string.punctuation + '\n'})
+whitespace = re.compile(r'\s+')
+
+def clean_text(text: str) -> str:
+    # remove punctuation and clean the text
+    text = whitespace.sub(' ', text.translate(punctuation_table)).strip()
+    # Convert to lower case
+    return text.lower()
+
+def extract_keywords(
+    text: str, 
+    is_query: bool = False, 
+    extract_phrases: bool = True
+) -> tuple[dict[str, int], set[str]]:
     global stemmer, rake
 
     if is_query:
         org_text = ''.join([c for c in text if c not in string.punctuation or c == '"']).strip()
-    # remove punctuation and clean the text
-    for c in string.punctuation:
-        text = text.replace(c, ' ')
-    text = text.replace('\n', ' ')
-    text = re.sub(r'\s+', ' ', text).strip()
-    # Convert to lower case
-    text: str = text.lower()
+    text: str = clean_text(text)
     if len(text) <= 0: return dict()
     # Tokenize words
     words: list[str] = word_tokenize(text)
@@ -84,21 +119,21 @@ def extract_keywords(text: str, is_query: bool = False) -> tuple[dict[str, int],
     phrases = list()
     page_all = set()
     error = False
-    try: 
-        rake.extract_keywords_from_text(text)
-    except:
-        print('Error, divide by 0', text)
-        error = True
+    if extract_phrases:
+        try: 
+            rake.extract_keywords_from_text(text)
+        except:
+            print('Error, divide by 0', text)
+            error = True
 
-    try: 
-        phrases = rake.get_ranked_phrases()
-    except:
-        phrases = list()
+        try: 
+            phrases = rake.get_ranked_phrases()
+        except:
+            phrases = list()
 
     must_inc_word = set()
     if is_query:
         page_all = set(extract_double_quoted_phrases(org_text))
-        print(page_all)
         phrases += [a.strip() for a in page_all if ' ' in a.strip()]
         for a in page_all:
             if ' ' not in a.strip(): 
@@ -122,6 +157,141 @@ def extract_keywords(text: str, is_query: bool = False) -> tuple[dict[str, int],
 
     return frequencies, must_inc_word
 
+# word_tokenize only splits these on text without punctuation, others are left to it
+plain_text = re.compile(r'[a-z0-9 ]*')
+contraction = re.compile(r'\b(?:cannot|gimme|gonna|gotta|lemme|wanna)\b')
+contractions = {'cannot', 'gimme', 'gonna', 'gotta', 'lemme', 'wanna'}
+
+@lru_cache(maxsize=stem_cache_size)
+def stem(word: str) -> str:
+    return stemmer.stem(word)
+
+@lru_cache(maxsize=stem_cache_size)
+def tokenize_word(word: str) -> tuple[tuple[str, ...], tuple[str, ...]]:
+    # word_tokenize and rake tokens of a space separated word of cleaned text
+    # the tokenizer rules only look within a word once punctuation and sentence ends are removed
+    return tuple(word_tokenize(word)), tuple(w.lower() for w in wordpunct_tokenize(word))
+
+# query analysis, same output as extract_keywords(query, is_query=True) without the document pipeline
+quote_table = str.maketrans('', '', string.punctuation.replace('"', ''))
+
+def is_plain_query(text: str) -> bool:
+    return plain_text.fullmatch(text) is not None and contraction.search(text) is None
+
+def analyze_query(query: str) -> tuple[dict[str, int], set[str]]:
+    text = clean_text(query)
+    if len(text) <= 0: return dict(), set()
+    if not is_plain_query(text): return extract_keywords(query, is_query=True)
+
+    stopwords = get_stopwords()
+    words = text.split(' ')
+    word_counts = Counter(stem(word) for word in words if word not in stopwords)
+    # rake phrases are the runs of words between its stop words
+    phrases = {' '.join(g) for is_phrase, g in groupby(words, lambda w: w not in rake.to_ignore) if is_phrase}
+
+    page_all = set(extract_double_quoted_phrases(query.translate(quote_table).strip()))
+    phrases.update(a for a in page_all if ' ' in a)
+    must_inc_word = {stem(a) for a in page_all if ' ' not in a}
+
+    output: dict[str, int] = dict()
+    for phrase in phrases:
+        w = [stem(word.strip()) for word in phrase.split(' ') if word not in stopwords and len(word) > 0]
+        if len(w) <= 1 or len(w) > 3: continue
+        freq = min([word_counts.get(a, 0) for a in w])
+        if freq <= 0: continue
+        output[' '.join(w)] = freq
+        if phrase in page_all: must_inc_word.add(' '.join(w))
+
+    return {**output, **word_counts}, must_inc_word
+
+def index_text(text: str, extract_phrases: bool = True) -> tuple[dict[str, int], dict[str, list[int]]]:
+    # same as extract_keywords(text, extract_phrases=extract_phrases) and extract_positions(text) in one pass
+    stopwords = get_stopwords()
+    word_counts: dict[str, int] = dict()
+    positions: dict[str, list[int]] = dict()
+    phrases: set[tuple[str, ...]] = set()
+    phrase: list[str] = list()
+
+    text = clean_text(text)
+    i = 0
+    for word in text.split(' ') if len(text) > 0 else list():
+        if word.isascii() and word.isalnum() and word not in contractions:
+            tokens, rake_tokens = (word,), (word,)
+        else:
+            tokens, rake_tokens = tokenize_word(word)
+
+        for token in tokens:
+            if token not in stopwords and len(token) > 0:
+                stemmed = stem(token)
+                word_counts[stemmed] = word_counts.get(stemmed, 0) + 1
+                positions.setdefault(stemmed, list()).append(i)
+            i += 1
+
+        if not extract_phrases: continue
+        # rake phrases are the runs of words between its stop words
+        for token in rake_tokens:
+            if token not in rake.to_ignore: phrase.append(token)
+            elif len(phrase) > 0:
+                phrases.add(tuple(phrase))
+                phrase = list()
+    if len(phrase) > 0: phrases.add(tuple(phrase))
+
+    output: dict[str, int] = dict()
+    for phrase in phrases:
+        w = [stem(word) for word in phrase if word not in stopwords and len(word) > 0]
+        # only select phrase with 2-3 words
+        if len(w) <= 1 or len(w) > 3: continue
+        freq = min([word_counts.get(a, 0) for a in w])
+        if freq <= 0: continue
+        output[' '.join(w)] = freq
+
+    return {**output, **word_counts}, positions
+
+def extract_positions(text: str) -> dict[str, list[int]]:
+    # token offsets of stemmed words, stop words are counted so that phrases keep their gaps
+    stopwords = get_stopwords()
+    positions: dict[str, list[int]] = dict()
+    for i, word in enumerate(word_tokenize(clean_text(text))):
+        if word in stopwords or len(word) <= 0: continue
+        positions.setdefault(stemmer.stem(word.strip()), list()).append(i)
+    return positions
+
+def extract_phrase_terms(text: str) -> list[list[tuple[int, str]]]:
+    # (offset in phrase, stemmed word) of each double quoted phrase with more than one word
+    phrases = []
+    for phrase in extract_double_quoted_phrases(text):
+        if ' ' not in phrase: continue
+        terms = sorted((p, w) for w, positions in extract_positions(phrase).items() for p in positions)
+        if len(terms) > 0: phrases.append([(p - terms[0][0], w) for p, w in terms])
+    return phrases
+
+def encode_positions(positions: list[int]) -> bytes:
+    # delta encoded varints
+    output = bytearray()
+    last = 0
+    for p in positions:
+        delta = p - last
+        last = p
+        while delta >= 0x80:
+            output.append((delta & 0x7f) | 0x80)
+            delta >>= 7
+        output.append(delta)
+    return bytes(output)
+
+def decode_positions(data: bytes | None) -> list[int]:
+    positions = []
+    if data is None: return positions
+    last, delta, shift = 0, 0, 0
+    for b in data:
+        delta |= (b & 0x7f) << shift
+        if b & 0x80:
+            shift += 7
+            continue
+        last += delta
+        positions.append(last)
+        delta, shift = 0, 0
+    return positions
+
 def merge_dict(a: dict, b: dict, func: Callable[[Any, Any], Any]) -> dict:
     n = dict()
     for k, v in a.items():
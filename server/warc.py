@@ -0,0 +1,114 @@
+from datetime import datetime, timezone
+from typing import Iterable
+from requests.structures import CaseInsensitiveDict
+import asyncio
+import gzip
+import httpx
+import requests
+import threading
+import time
+import uuid
+
+# http responses of a crawl in a WARC file, gzipped per record if the path ends with .gz
+# bodies are stored decoded, without the Content-Encoding and Transfer-Encoding headers
+skipped_headers = {'content-encoding', 'transfer-encoding'}
+
+class WarcWriter:
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, 'ab')
+        self.lock = threading.Lock()
+
+    def write(self, url: str, status_code: int, reason: str, headers: Iterable[tuple[str, str]], body: bytes):
+        # one response record
+        http = f'HTTP/1.1 {status_code} {reason}\r\n'
+        http += ''.join(f'{k}: {v}\r\n' for k, v in headers if k.lower() not in skipped_headers)
+        block = (http + '\r\n').encode('latin-1') + body
+        record = (
+            'WARC/1.1\r\n'
+            'WARC-Type: response\r\n'
+            f'WARC-Record-ID: <urn:uuid:{uuid.uuid4()}>\r\n'
+            f'WARC-Date: {datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")}\r\n'
+            f'WARC-Target-URI: {url}\r\n'
+            'Content-Type: application/http; msgtype=response\r\n'
+            f'Content-Length: {len(block)}\r\n'
+            '\r\n'
+        ).encode('utf-8') + block + b'\r\n\r\n'
+        if self.path.endswith('.gz'): record = gzip.compress(record)
+        with self.lock:
+            self.file.write(record)
+            self.file.flush()
+
+    def close(self):
+        with self.lock: self.file.close()
+
+def read_fields(f) -> dict[str, str] | None:
+    # header fields of a record, None at the end of the file
+    line = f.readline()
+    while line in (b'\r\n', b'\n'): line = f.readline()
+    if line == b'': return None
+    if not line.startswith(b'WARC/'): raise ValueError(f'Invalid WARC record: {line[:50]!r}')
+    fields = dict()
+    while (line := f.readline()) not in (b'\r\n', b'\n', b''):
+        k, _, v = line.decode('utf-8').partition(':')
+        fields[k.strip().lower()] = v.strip()
+    return fields
+
+def parse_http(block: bytes) -> tuple[int, str, list[tuple[str, str]], bytes]:
+    head, _, body = block.partition(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    _, status_code, reason = (lines[0].split(' ', 2) + [''])[:3]
+    headers = [(k.strip(), v.strip()) for k, _, v in (line.partition(':') for line in lines[1:])]
+    return int(status_code), reason, headers, body
+
+def read_warc(path: str) -> dict[str, tuple[int, str, list[tuple[str, str]], bytes]]:
+    # url: (status code, reason, headers, body) of its last response record
+    responses = dict()
+    with (gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')) as f:
+        while (fields := read_fields(f)) is not None:
+            block = f.read(int(fields['content-length']))
+            if fields.get('warc-type') != 'response': continue
+            responses[fields['warc-target-uri']] = parse_http(block)
+    return responses
+
+class WarcArchive:
+    # recorded responses served in place of the network, after latency seconds
+    def __init__(self, path: str, latency: float = 0):
+        self.responses = read_warc(path)
+        self.latency = latency
+
+    def get(self, url: str) -> tuple[int, str, list[tuple[str, str]], bytes] | None:
+        return self.responses.get(url, None)
+
+class ReplayAdapter(requests.adapters.BaseAdapter):
+    # requests transport of fetch_page while replaying
+    def __init__(self, archive: WarcArchive):
+        super().__init__()
+        self.archive = archive
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        recorded = self.archive.get(request.url)
+        if recorded is None: raise requests.ConnectionError(f'{request.url} is not in the archive', request=request)
+        time.sleep(self.archive.latency)
+        response = requests.Response()
+        response.status_code, response.reason, headers, response._content = recorded
+        response._content_consumed = True # streamed from _content
+        response.headers = CaseInsensitiveDict(headers)
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self): pass
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    # httpx transport of fetch_page_async while replaying
+    def __init__(self, archive: WarcArchive):
+        self.archive = archive
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        recorded = self.archive.get(str(request.url))
+        if recorded is None: raise httpx.ConnectError(f'{request.url} is not in the archive', request=request)
+        await asyncio.sleep(self.archive.latency)
+        status_code, reason, headers, body = recorded
+        return httpx.Response(status_code, headers=headers, content=body, extensions={'reason_phrase': reason.encode()})